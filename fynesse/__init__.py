@@ -1,2 +1,5 @@
-from . import access
-from . import assess
+from fynesse._lazy import lazy_submodules
+
+__all__ = ["access", "address", "assess", "common"]
+
+__getattr__, __dir__ = lazy_submodules(__name__, __all__)
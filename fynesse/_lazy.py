@@ -0,0 +1,17 @@
+import importlib
+import sys
+
+
+def lazy_submodules(package_name, submodules):
+    # PEP 562: submodules are imported on first access, so importing the package stays cheap.
+    def __getattr__(name):
+        if name in submodules:
+            module = importlib.import_module(f".{name}", package_name)
+            setattr(sys.modules[package_name], name, module)
+            return module
+        raise AttributeError(f"module {package_name!r} has no attribute {name!r}")
+
+    def __dir__():
+        return sorted(set(vars(sys.modules[package_name])) | set(submodules))
+
+    return __getattr__, __dir__
@@ -1,6 +1,5 @@
-from . import clean
-from . import fetch
-from . import join
-from . import optimise
-from . import pipelines
-from . import upload
+from fynesse._lazy import lazy_submodules
+
+__all__ = ["clean", "fetch", "http_cache", "join", "optimise", "pipelines", "upload"]
+
+__getattr__, __dir__ = lazy_submodules(__name__, __all__)
@@ -1,18 +1,194 @@
 import re
+from typing import Callable, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+
+PRACTICALS_URL = "https://github.com/FlamingoWinter/ads_practicals/raw/refs/heads/main"
+
+# Nomis bulk downloads start with these columns; every other header is "<table title>: <category>".
+NOMIS_KEY_COLUMNS = {"geography": "Geography", "geography code": "Geography_Code"}
+
+
+class CensusSpec(NamedTuple):
+    name: str
+    code: str
+    # Source header names mapped to their target names.
+    key_columns: dict
+    # A {source: target} mapping; target names in category order when unstacking; or the source
+    # column after which every column is a value column, with targets from rename. Sources that
+    # aren't exact headers are matched against the category after the table title.
+    value_columns: Union[dict, Tuple[str, ...], str]
+    # (category column, value column) of a long-format table to spread into one column per category.
+    unstack: Optional[Tuple[str, str]] = None
+    rename: Optional[Callable] = None
+    url: Optional[str] = None
+    # Bump whenever the cleaned output changes, so cached tables are rebuilt.
+    version: int = 1
+
+
+def _work_type_detailed_name(col_name):
+    camel_case = "_".join(col_name.split(":", 1)[-1].strip().split(" ")).lower()
+    clean = re.sub(r'[^\w\s]', '', camel_case)
+    return clean[:25].rsplit("_", 1)[0] + "_" + (clean[25:].rsplit("_", 1)[-1])
+
+
+NSSEC = CensusSpec(
+        "nssec", "TS062",
+        key_columns=NOMIS_KEY_COLUMNS,
+        value_columns={"L1, L2 and L3": "L1-L3",
+                       "L4, L5 and L6": "L4-L6",
+                       "L7"           : "L7",
+                       "L8 and L9"    : "L8-9",
+                       "L10 and L11"  : "L10-L11",
+                       "L12"          : "L12",
+                       "L13"          : "L13",
+                       "L14"          : "L14",
+                       "L15"          : "L15"}
+)
+
+SEXUAL_ORIENTATION = CensusSpec(
+        "sexual_orientation", "TS077",
+        key_columns=NOMIS_KEY_COLUMNS,
+        value_columns={"Straight or Heterosexual": "Heterosexual",
+                       "Gay or Lesbian"          : "Gay_or_Lesbian",
+                       "Bisexual"                : "Bisexual",
+                       "All other"               : "Other",
+                       "Not answered"            : "Not_Answered"}
+)
+
+WORK_TYPE = CensusSpec(
+        "work_type", "TS063",
+        key_columns={"Output Areas Code": "Geography_Code"},
+        value_columns=("managers_directors_senior_officials",
+                       "professional",
+                       "associate_professional_technical",
+                       "administrative_secretarial",
+                       "skilled_trades",
+                       "caring_leisure_other_service",
+                       "sales_customer_service",
+                       "process_plant_machine_operatives",
+                       "elementary",
+                       "does_not_apply"),
+        unstack=("Occupation (current) (10 categories)", "Observation"),
+        url=f"{PRACTICALS_URL}/occupation_by_oa.zip"
+)
+
+WORK_TYPE_DETAILED = CensusSpec(
+        "work_type_detailed", "TS064",
+        key_columns={"geography code": "Geography_Code"},
+        value_columns="Total",
+        rename=_work_type_detailed_name
+)
+
+COMMUTER_DISTANCE = CensusSpec(
+        "commuter_distance", "TS058",
+        key_columns={"geography code": "Geography_Code"},
+        value_columns={"Total"                 : "dist_total_all_usual_residents",
+                       "Less than 2km"         : "dist_less_than_2km",
+                       "2km to less than 5km"  : "dist_2km_to_less_than_5km",
+                       "5km to less than 10km" : "dist_5km_to_less_than_10km",
+                       "10km to less than 20km": "dist_10km_to_less_than_20km",
+                       "20km to less than 30km": "dist_20km_to_les_than_30km",
+                       "30km to less than 40km": "dist_30km_to_less_than_40km",
+                       "40km to less than 60km": "dist_40km_to_less_than_60km",
+                       "60km and over"         : "dist_60km_and_over",
+                       "Works mainly from home": "dist_works_mainly_from_home",
+                       "Works mainly at an offshore installation":
+                           "dist_offshore_no_fixed_place_outside_uk"}
+)
+
+HOURS_WORKED = CensusSpec(
+        "hours_worked", "TS059",
+        key_columns={"geography code": "Geography_Code"},
+        value_columns={"Total"                      : "hours_total_all_usual_residents",
+                       "Part-time"                  : "hours_part_time",
+                       "Part-time: 15 hours or less": "hours_part_time_15_or_less",
+                       "Part-time: 16 to 30 hours"  : "hours_part_time_16_to_30",
+                       "Full-time"                  : "hours_fulltime",
+                       "Full-time: 31 to 48 hours"  : "hours_fulltime_31_to_48",
+                       "Full-time: 49 or more hours": "hours_fulltime_49_or_more"}
+)
+
+CENSUS_SPECS = {spec.name: spec for spec in [NSSEC, SEXUAL_ORIENTATION, WORK_TYPE,
+                                             WORK_TYPE_DETAILED, COMMUTER_DISTANCE,
+                                             HOURS_WORKED]}
+
+
+def _find_column(header: list, source: str, spec: CensusSpec) -> str:
+    if source in header:
+        return source
+
+    # Categories are matched case-insensitively, exactly if possible and otherwise by prefix, so a
+    # spec doesn't repeat the table title or the long tail of every category name.
+    categories = {col: col.split(":", 1)[-1].strip().lower() for col in header}
+    matches = [col for col, category in categories.items() if category == source.lower()]
+    matches = matches or [col for col, category in categories.items()
+                          if category.startswith(source.lower())]
+    if len(matches) != 1:
+        raise ValueError(f"{spec.name} column {source!r} matches {len(matches)} of {header}")
+    return matches[0]
+
+
+def _source_columns(spec: CensusSpec, header: list) -> Tuple[dict, dict]:
+    name = lambda source: _find_column(header, source, spec)
+
+    keys = {name(source): target for source, target in spec.key_columns.items()}
+    if spec.unstack:
+        values = {name(source): None for source in spec.unstack}
+    elif isinstance(spec.value_columns, str):
+        first = header.index(name(spec.value_columns)) + 1
+        values = {col: spec.rename(col) for col in header[first:]}
+    else:
+        values = {name(source): target for source, target in spec.value_columns.items()}
+    return keys, values
+
+
+def compact_census_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    for col in df.columns:
+        column = df[col]
+        if pd.api.types.is_integer_dtype(column) and (
+                len(column) == 0 or (column.min() >= 0 and column.max() <= np.iinfo(np.uint32).max)):
+            df[col] = column.astype(np.uint32)
+        elif pd.api.types.is_object_dtype(column) or pd.api.types.is_string_dtype(column):
+            df[col] = column.astype("category")
+    return df
+
+
+def clean_census_frame(raw: pd.DataFrame, spec: CensusSpec, header=None) -> pd.DataFrame:
+    # header is the full CSV header when raw was read with only the columns the spec needs.
+    keys, values = _source_columns(spec, list(raw.columns) if header is None else list(header))
+
+    if spec.unstack:
+        category, value = spec.unstack
+        # Categories sort like pivot_table's columns, and unstack on their codes is far cheaper.
+        frame = (raw[list(keys) + [category, value]]
+                 .astype({category: "category"})
+                 .set_index(list(keys) + [category])[value]
+                 .unstack(category))
+        frame.columns = list(spec.value_columns)
+        frame = frame.reset_index().rename(columns=keys)
+    else:
+        frame = raw[list(keys) + list(values)].rename(columns={**keys, **values})
+
+    return compact_census_dtypes(frame)
+
+
+def read_census_csv(path: str, spec: CensusSpec) -> pd.DataFrame:
+    header = list(pd.read_csv(path, nrows=0).columns)
+    keys, values = _source_columns(spec, header)
+    raw = pd.read_csv(path, engine="pyarrow", usecols=list(keys) + list(values))
+    return clean_census_frame(raw, spec, header)
 
 
 def clean_nssec(raw_nssec):
-    nssec = raw_nssec.drop(raw_nssec.columns[[0, 3]], axis=1)
-    nssec.columns = ["Geography", "Geography_Code", "L1-L3", "L4-L6", "L7", "L8-9", "L10-L11",
-                     "L12", "L13", "L14", "L15"]
-    return nssec
+    return clean_census_frame(raw_nssec, NSSEC)
 
 
 def clean_sexual_orientation(raw_sexual_orientation):
-    sexual_orientation = raw_sexual_orientation.drop(raw_sexual_orientation.columns[[0, 3]], axis=1)
-    sexual_orientation.columns = ["Geography", "Geography_Code", "Heterosexual", "Gay_or_Lesbian",
-                                  "Bisexual", "Other", "Not_Answered"]
-    return sexual_orientation
+    return clean_census_frame(raw_sexual_orientation, SEXUAL_ORIENTATION)
 
 
 def clean_geography_oa(raw_geography_oa):
@@ -42,73 +218,16 @@ def calculate_so_totals(so):
 
 
 def clean_work_type(raw_work_type):
-    work_type = raw_work_type.pivot_table(
-            index=["Output Areas Code", "Output Areas"],
-            columns="Occupation (current) (10 categories)",
-            values="Observation",
-            aggfunc="first"
-    ).reset_index()
-    work_type.columns = ["Geography_Code", "Geography", "managers_directors_senior_officials",
-                         "professional",
-                         "associate_professional_technical",
-                         "administrative_secretarial",
-                         "skilled_trades",
-                         "caring_leisure_other_service",
-                         "sales_customer_service",
-                         "process_plant_machine_operatives",
-                         "elementary",
-                         "does_not_apply"]
-    work_type = work_type.drop(columns=["Geography"])
-    return work_type
+    return clean_census_frame(raw_work_type, WORK_TYPE)
 
 
 def clean_work_type_detailed(raw_work_type_detailed):
-    def convert_column(col_name):
-        camel_case = "_".join(col_name.split(":", 1)[-1].strip().split(" ")).lower()
-        clean = re.sub(r'[^\w\s]', '', camel_case)
-        return clean[:25].rsplit("_", 1)[0] + "_" + (clean[25:].rsplit("_", 1)[-1])
-
-    work_type_detailed = raw_work_type_detailed.drop(raw_work_type_detailed.columns[[0, 3]], axis=1)
-
-    work_type_detailed.columns = ["Geography", "Geography_Code"] + [convert_column(col) for col in
-                                                                    work_type_detailed.columns][2:]
-    work_type_detailed = work_type_detailed.drop(columns=["Geography"])
-    return work_type_detailed
+    return clean_census_frame(raw_work_type_detailed, WORK_TYPE_DETAILED)
 
 
 def clean_commuter_distance(raw_commuter_distance):
-    commuter_distance = raw_commuter_distance.drop(raw_commuter_distance.columns[[0]], axis=1)
-    commuter_distance.columns = [
-            "Geography",
-            "Geography_Code",
-            "dist_total_all_usual_residents",
-            "dist_less_than_2km",
-            "dist_2km_to_less_than_5km",
-            "dist_5km_to_less_than_10km",
-            "dist_10km_to_less_than_20km",
-            "dist_20km_to_les_than_30km",
-            "dist_30km_to_less_than_40km",
-            "dist_40km_to_less_than_60km",
-            "dist_60km_and_over",
-            "dist_works_mainly_from_home",
-            "dist_offshore_no_fixed_place_outside_uk"
-    ]
-    commuter_distance = commuter_distance.drop(columns=["Geography"])
-    return commuter_distance
+    return clean_census_frame(raw_commuter_distance, COMMUTER_DISTANCE)
 
 
 def clean_hours_worked(raw_hours_worked):
-    hours_worked = raw_hours_worked.drop(raw_hours_worked.columns[[0]], axis=1)
-    hours_worked.columns = [
-            "Geography",
-            "Geography_Code",
-            "hours_total_all_usual_residents",
-            "hours_part_time",
-            "hours_part_time_15_or_less",
-            "hours_part_time_16_to_30",
-            "hours_fulltime",
-            "hours_fulltime_31_to_48",
-            "hours_fulltime_49_or_more"
-    ]
-    hours_worked = hours_worked.drop(columns=["Geography"])
-    return hours_worked
+    return clean_census_frame(raw_hours_worked, HOURS_WORKED)
@@ -1,14 +1,77 @@
-import io
+import json
+import multiprocessing
 import os
 import time
-import zipfile
+from concurrent.futures import ProcessPoolExecutor
 from typing import Literal
 
 import geopandas as gpd
 import pandas as pd
-import requests
+
+from fynesse.access.clean import CENSUS_SPECS, PRACTICALS_URL, CensusSpec, read_census_csv
+from fynesse.access.http_cache import (cached_archive, cached_download, cached_metadata, invalidate,
+                                       prefetch)
 
 DATA_DIRECTORY = "fetched_data"
+CENSUS_CACHE_DIRECTORY = os.path.join(DATA_DIRECTORY, "census_parquet")
+GEOGRAPHY_CACHE_DIRECTORY = os.path.join(DATA_DIRECTORY, "census2021-geography")
+POSTCODE_URL = "https://www.getthedata.com/downloads/open_postcode_geo.csv.zip"
+
+GEOGRAPHY_URL_BY_LEVEL = {
+        'oa'  : "https://open-geography-portalx-ons.hub.arcgis.com/api/download/v1/items/6beafcfd9b9c4c9993a06b6b199d7e6d/geojson?layers=0",
+        'msoa': "https://open-geography-portalx-ons.hub.arcgis.com/api/download/v1/items/61ff711e89ba4c24ae5dc8a487e422a8/geojson?layers=0"
+}
+
+
+def census_url(code: str, custom_url=None) -> str:
+    return custom_url or f'https://www.nomisweb.co.uk/output/census/2021/census2021-{code.lower()}.zip'
+
+
+# Everything the pipelines download, so a machine can be primed before going offline.
+MANIFEST = {
+        "census"   : [census_url(spec.code, spec.url) for spec in CENSUS_SPECS.values()],
+        "geography": [(url, f"census2021-{level}.geojson")
+                      for level, url in GEOGRAPHY_URL_BY_LEVEL.items()],
+        "osm"      : [f"{PRACTICALS_URL}/uk-beaches.zip", f"{PRACTICALS_URL}/coast.zip"],
+        "work_type": [f"{PRACTICALS_URL}/{name}.csv"
+                      for name in ["hours_worked_by_detailed_work_type", "hours_worked_by_work_type",
+                                   "distance_travelled_by_work_type",
+                                   "distance_travelled_by_detailed_work_type"]],
+        "postcode" : [POSTCODE_URL],
+}
+
+
+def manifest_urls(groups=None):
+    urls = [url for group, group_urls in MANIFEST.items()
+            if groups is None or group in groups for url in group_urls]
+
+    if groups is None or "price_paid" in groups:
+        from fynesse.common.pipelines.price_paid import parts_to_process, price_paid_url
+        urls += [price_paid_url(year, part) for year, part in parts_to_process(1994, 2)]
+    return urls
+
+
+def prefetch_manifest(groups=None, workers=8):
+    return prefetch(manifest_urls(groups), workers)
+
+
+def census_csv_path(code: str, level: str, custom_url=None) -> str:
+    url = census_url(code, custom_url)
+
+    extract_dir = os.path.join(DATA_DIRECTORY, os.path.splitext(os.path.basename(url))[0])
+    cached_archive(url, extract_dir)
+
+    if not custom_url:
+        path = f'{extract_dir}/census2021-{code.lower()}-{level}.csv'
+    else:
+        filename = next(file for file in os.listdir(extract_dir) if file.endswith('.csv'))
+        path = f"{extract_dir}/{filename}"
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+                f"File not found in download. Data may not exist for the {level} level"
+        )
+    return path
 
 
 # This was adapted from the example in practical 3
@@ -17,87 +80,112 @@ def fetch_2021_census_data(
         level: Literal['ctry', 'rgn', 'utla', 'ltla', 'msoa', 'oa'] = 'oa',
         custom_url=None
 ) -> pd.DataFrame:
-    if custom_url is None:
-        url = f'https://www.nomisweb.co.uk/output/census/2021/census2021-{code.lower()}.zip'
-    else:
-        url = custom_url
+    return pd.read_csv(census_csv_path(code, level, custom_url), engine="pyarrow")
 
-    extract_dir = os.path.join(DATA_DIRECTORY, os.path.splitext(os.path.basename(url))[0])
 
-    if not (os.path.exists(extract_dir) and os.listdir(extract_dir)):
-        os.makedirs(extract_dir, exist_ok=True)
-        response = requests.get(url)
-        response.raise_for_status()
+def fetch_clean_census_data(
+        spec: CensusSpec,
+        level: Literal['ctry', 'rgn', 'utla', 'ltla', 'msoa', 'oa'] = 'oa'
+) -> pd.DataFrame:
+    csv_path = census_csv_path(spec.code, level, spec.url)
 
-        with zipfile.ZipFile(io.BytesIO(response.content)) as zip_ref:
-            zip_ref.extractall(extract_dir)
+    # Keyed by the source archive's hash as well as the spec, so a republished table or a
+    # changed spec never serves a stale frame.
+    source = cached_metadata(census_url(spec.code, spec.url))["sha256"][:12]
+    path = os.path.join(CENSUS_CACHE_DIRECTORY,
+                        f"census2021-{spec.code.lower()}-{level}-{spec.name}"
+                        f"-v{spec.version}-{source}.parquet")
 
-    try:
-        if not custom_url:
-            return pd.read_csv(f'{extract_dir}/census2021-{code.lower()}-{level}.csv')
-        filename = next(file for file in os.listdir(extract_dir) if file.endswith('.csv'))
-        return pd.read_csv(f"{extract_dir}/{filename}")
-    except FileNotFoundError:
-        raise FileNotFoundError(
-                f"File not found in download. Data may not exist for the {level} level"
-        )
+    if os.path.exists(path):
+        return pd.read_parquet(path, engine="pyarrow")
 
+    df = read_census_csv(csv_path, spec)
 
-def fetch_2021_census_geography(
-        level: Literal['msoa', 'oa'] = 'msoa'
-) -> gpd.GeoDataFrame:
-    url_by_level = {
-            'oa'  : "https://open-geography-portalx-ons.hub.arcgis.com/api/download/v1/items/6beafcfd9b9c4c9993a06b6b199d7e6d/geojson?layers=0",
-            'msoa': "https://open-geography-portalx-ons.hub.arcgis.com/api/download/v1/items/61ff711e89ba4c24ae5dc8a487e422a8/geojson?layers=0"
-    }
-    url = url_by_level[level]
+    os.makedirs(CENSUS_CACHE_DIRECTORY, exist_ok=True)
+    df.to_parquet(f"{path}.tmp", engine="pyarrow", index=False)
+    os.replace(f"{path}.tmp", path)
+    return df
 
-    extract_dir = os.path.join(DATA_DIRECTORY, "census2021-geography")
-    path = os.path.join(extract_dir, f"census2021-{level}.geojson")
 
-    if not os.path.exists(path):
-        pending = True
+def fetch_clean_census_tables(tables, workers=4) -> list:
+    tables = [(CENSUS_SPECS[spec] if isinstance(spec, str) else spec, level)
+              for spec, level in tables]
+    unique = list({(spec.name, level): (spec, level) for spec, level in tables}.values())
+
+    # Archives are downloaded and extracted here first, so worker processes only read them and
+    # never race to write the same cache entry.
+    prefetch([census_url(spec.code, spec.url) for spec, _ in unique], workers)
+    for spec, level in unique:
+        census_csv_path(spec.code, level, spec.url)
+
+    if workers <= 1 or len(unique) <= 1:
+        frames = [fetch_clean_census_data(spec, level) for spec, level in unique]
+    else:
+        # This can run on a scheduler thread; forking a threaded process that holds open sockets
+        # and locks can hang the children, so they are spawned fresh instead.
+        with ProcessPoolExecutor(max_workers=min(workers, len(unique)),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            frames = list(executor.map(fetch_clean_census_data, *zip(*unique)))
+
+    frame_by_table = {(spec.name, level): frame for (spec, level), frame in zip(unique, frames)}
+    return [frame_by_table[(spec.name, level)] for spec, level in tables]
+
 
-        response = None
-        while pending:
+def _download_census_geography(level: Literal['msoa', 'oa']) -> str:
+    url = GEOGRAPHY_URL_BY_LEVEL[level]
+    file_name = f"census2021-{level}.geojson"
+
+    while True:
+        path = cached_download(url, file_name=file_name)
+        # While the export is being generated the portal answers with a small status document,
+        # which mustn't be kept as the cached geography.
+        if os.path.getsize(path) > 4096:
+            break
+        try:
+            with open(path) as file:
+                pending = json.load(file).get("status") == "Pending"
+        except ValueError:
             pending = False
-            response = requests.get(url)
-            response.raise_for_status()
+        if not pending:
+            break
+
+        print("File not ready. Retrying.")
+        invalidate(url, file_name)
+        time.sleep(1)
+
+    return path
+
 
-            try:
-                data = response.json()
-                if data.get("status") == "Pending":
-                    print("File not ready. Retrying.")
-                    time.sleep(1)
-                    pending = True
-            except ValueError:
-                pass
+def fetch_2021_census_geography(
+        level: Literal['msoa', 'oa'] = 'msoa',
+        columns=None,
+        bbox=None,
+        memory_map=False
+) -> gpd.GeoDataFrame:
+    geojson_path = _download_census_geography(level)
+    source = cached_metadata(GEOGRAPHY_URL_BY_LEVEL[level],
+                             f"census2021-{level}.geojson")["sha256"][:12]
+    path = os.path.join(GEOGRAPHY_CACHE_DIRECTORY, f"census2021-{level}-{source}.parquet")
+
+    # The GeoJSON is parsed once into GeoParquet with per-row bounding boxes, which later reads
+    # can filter on without decoding the geometries outside bbox.
+    if not os.path.exists(path):
+        gdf = gpd.read_file(geojson_path, engine="pyogrio", use_arrow=True)
+        gdf = gdf.set_geometry('geometry')
 
-        os.makedirs(extract_dir, exist_ok=True)
-        with open(path, 'wb') as f:
-            f.write(response.content)
+        os.makedirs(GEOGRAPHY_CACHE_DIRECTORY, exist_ok=True)
+        gdf.to_parquet(f"{path}.tmp", write_covering_bbox=True)
+        os.replace(f"{path}.tmp", path)
 
-    gdf = gpd.read_file(path)
-    gpd.read_file(path)
-    gdf = gdf.set_geometry('geometry')
+    if columns is not None and 'geometry' not in columns:
+        columns = list(columns) + ['geometry']
 
-    return gdf
+    return gpd.read_parquet(path, columns=columns, bbox=bbox, memory_map=memory_map)
 
 
 def fetch_uk_beaches():
     # from https://overpass-turbo.eu/
-    url = "https://github.com/FlamingoWinter/ads_practicals/raw/refs/heads/main/uk-beaches.zip"
-    zip_folder = "uk-beaches.zip"
-    ext_folder = "beaches"
-
-    if not os.path.exists(ext_folder):
-        response = requests.get(url)
-        with open(zip_folder, "wb") as file:
-            file.write(response.content)
-
-        os.makedirs(ext_folder, exist_ok=True)
-        with zipfile.ZipFile(zip_folder, 'r') as zip_ref:
-            zip_ref.extractall(ext_folder)
+    ext_folder = cached_archive(f"{PRACTICALS_URL}/uk-beaches.zip", "beaches")
 
     for file in os.listdir(ext_folder):
         if file.endswith(".geojson"):
@@ -120,18 +208,7 @@ def fetch_uk_beaches():
 
 def fetch_coast():
     # from https://overpass-turbo.eu/
-    url = "https://github.com/FlamingoWinter/ads_practicals/raw/refs/heads/main/coast.zip"
-    zip_folder = "coast.zip"
-    ext_folder = "coast"
-
-    if not os.path.exists(ext_folder):
-        response = requests.get(url)
-        with open(zip_folder, "wb") as file:
-            file.write(response.content)
-
-        os.makedirs(ext_folder, exist_ok=True)
-        with zipfile.ZipFile(zip_folder, 'r') as zip_ref:
-            zip_ref.extractall(ext_folder)
+    ext_folder = cached_archive(f"{PRACTICALS_URL}/coast.zip", "coast")
 
     for file in os.listdir(ext_folder):
         if file.endswith(".geojson"):
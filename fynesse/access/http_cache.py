@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
+from urllib.parse import urlparse
+
+import pandas as pd
+import requests
+
+CACHE_DIRECTORY = os.environ.get("FYNESSE_HTTP_CACHE", os.path.join("fetched_data", "http_cache"))
+DEFAULT_MAX_AGE_SECONDS = 24 * 60 * 60
+CHUNK_BYTES = 1 << 20
+ARCHIVE_MARKER = ".source-sha256"
+
+offline = os.environ.get("FYNESSE_OFFLINE", "").strip().lower() in ["1", "true", "yes"]
+
+
+def set_offline(enabled: bool = True) -> None:
+    global offline
+    offline = enabled
+
+
+def cache_path(url: str, file_name: Union[str, None] = None) -> str:
+    name = file_name or os.path.basename(urlparse(url).path) or "index"
+    key = hashlib.sha256(url.encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIRECTORY, f"{key}-{name}")
+
+
+def _read_json(path: str) -> Union[dict, None]:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path: str, data: dict) -> None:
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as file:
+        json.dump(data, file)
+    os.replace(temporary_path, path)
+
+
+def _remove(*paths: str) -> None:
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _hash_file(path: str, algorithm: str = "sha256") -> str:
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cached_metadata(url: str, file_name: Union[str, None] = None) -> Union[dict, None]:
+    path = cache_path(url, file_name)
+    metadata = _read_json(f"{path}.json")
+    if metadata is None or not os.path.exists(path) or os.path.getsize(path) != metadata["size"]:
+        return None
+    return metadata
+
+
+def invalidate(url: str, file_name: Union[str, None] = None) -> None:
+    path = cache_path(url, file_name)
+    _remove(f"{path}.json", path, f"{path}.part", f"{path}.part.json")
+
+
+def verify(url: str, file_name: Union[str, None] = None) -> bool:
+    metadata = cached_metadata(url, file_name)
+    return metadata is not None and _hash_file(cache_path(url, file_name)) == metadata["sha256"]
+
+
+def cached_download(url: str, max_age: Union[float, None] = DEFAULT_MAX_AGE_SECONDS,
+                    file_name: Union[str, None] = None
+                    ) -> str:
+    path = cache_path(url, file_name)
+    metadata_path, partial_path = f"{path}.json", f"{path}.part"
+    metadata = cached_metadata(url, file_name)
+
+    # Within max_age (forever when None) a cached copy is used without touching the network; after
+    # that it is revalidated with a conditional request, which costs headers only when unchanged.
+    if metadata is not None and (offline or max_age is None
+                                 or time.time() - metadata["checked_at"] < max_age):
+        return path
+    if offline:
+        raise FileNotFoundError(f"{url} is not cached and offline mode is on")
+
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    headers = {}
+    if metadata is not None:
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+
+    # An interrupted download resumes from its .part file, but only if the resource is unchanged
+    # since it started; otherwise If-Range makes the server send the whole new version.
+    partial = _read_json(f"{partial_path}.json")
+    if partial is not None and os.path.exists(partial_path):
+        validator = partial.get("etag") or partial.get("last_modified")
+        if validator:
+            headers["Range"] = f"bytes={os.path.getsize(partial_path)}-"
+            headers["If-Range"] = validator
+
+    with requests.get(url, headers=headers, stream=True, timeout=60) as response:
+        if response.status_code == 304:
+            metadata["checked_at"] = time.time()
+            _write_json(metadata_path, metadata)
+            return path
+
+        # A range starting at the end of the resource is unsatisfiable: if the .part file is
+        # exactly that long it was complete when interrupted, otherwise it's discarded.
+        complete = False
+        if response.status_code == 416 and "Range" in headers:
+            total = response.headers.get("Content-Range", "").rpartition("/")[2]
+            complete = total.isdigit() and int(total) == os.path.getsize(partial_path)
+            if not complete:
+                response.close()
+                _remove(partial_path, f"{partial_path}.json")
+                return cached_download(url, max_age, file_name)
+
+        if not complete:
+            response.raise_for_status()
+            appending = response.status_code == 206
+            if not appending:
+                partial = {"etag": response.headers.get("ETag"),
+                           "last_modified": response.headers.get("Last-Modified")}
+                _write_json(f"{partial_path}.json", partial)
+
+            print(f"{'Resuming' if appending else 'Downloading'} {url}")
+            with open(partial_path, "ab" if appending else "wb") as file:
+                for chunk in response.iter_content(chunk_size=CHUNK_BYTES):
+                    file.write(chunk)
+
+    # S3 ETags of single-part uploads are the MD5 of the object; multipart ones contain a "-".
+    etag = (partial["etag"] or "").strip('"')
+    if re.fullmatch(r"[0-9a-f]{32}", etag) and _hash_file(partial_path, "md5") != etag:
+        _remove(partial_path, f"{partial_path}.json")
+        raise IOError(f"Checksum mismatch for {url}, removed the download")
+
+    _remove(metadata_path)
+    os.replace(partial_path, path)
+    now = time.time()
+    _write_json(metadata_path, {
+            "url"          : url,
+            "etag"         : partial["etag"],
+            "last_modified": partial["last_modified"],
+            "sha256"       : _hash_file(path),
+            "size"         : os.path.getsize(path),
+            "fetched_at"   : now,
+            "checked_at"   : now,
+    })
+    _remove(f"{partial_path}.json")
+    return path
+
+
+def read_csv(url: str, max_age: Union[float, None] = DEFAULT_MAX_AGE_SECONDS, **kwargs
+             ) -> pd.DataFrame:
+    return pd.read_csv(cached_download(url, max_age), **kwargs)
+
+
+def cached_archive(url: str, extract_dir: str,
+                   max_age: Union[float, None] = DEFAULT_MAX_AGE_SECONDS
+                   ) -> str:
+    archive_path = cached_download(url, max_age)
+    sha256 = cached_metadata(url)["sha256"]
+
+    marker_path = os.path.join(extract_dir, ARCHIVE_MARKER)
+    if os.path.exists(marker_path):
+        with open(marker_path) as marker:
+            if marker.read().strip() == sha256:
+                return extract_dir
+
+    shutil.rmtree(extract_dir, ignore_errors=True)
+    os.makedirs(extract_dir)
+    with zipfile.ZipFile(archive_path) as zip_ref:
+        zip_ref.extractall(extract_dir)
+    with open(marker_path, "w") as marker:
+        marker.write(sha256)
+    return extract_dir
+
+
+def prefetch(urls, workers: int = 8, max_age: Union[float, None] = DEFAULT_MAX_AGE_SECONDS
+             ) -> dict:
+    # Entries are urls, or (url, file_name) pairs for urls whose path doesn't name the file.
+    entries = [(entry, None) if isinstance(entry, str) else tuple(entry) for entry in urls]
+    entries = list(dict.fromkeys(entries))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {(url, file_name): executor.submit(cached_download, url, max_age, file_name)
+                   for url, file_name in entries}
+
+    paths, failures = {}, []
+    for (url, _), future in futures.items():
+        try:
+            paths[url] = future.result()
+        except Exception as e:
+            failures.append(url)
+            print(f"Could not prefetch {url}: {e}")
+
+    if failures:
+        raise IOError(f"Failed to prefetch {len(failures)} of {len(entries)} urls")
+    print(f"Prefetched {len(entries)} urls into {CACHE_DIRECTORY}")
+    return paths
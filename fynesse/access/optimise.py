@@ -1,4 +1,5 @@
 from fynesse.common.db import db
+from fynesse.common.db import db_advisor
 from fynesse.common.db import db_index_management
 
 
@@ -10,5 +11,13 @@ def add_multiple_indexes(connection, table_name, column_names):
     return db_index_management.add_multiple_indexes(connection, table_name, column_names)
 
 
+def apply_index_plan(connection, index_plan, parallel=False):
+    return db_index_management.apply_index_plan(connection, index_plan, parallel)
+
+
+def advise_indexes(connection, min_seconds=0.5, apply=False):
+    return db_advisor.advise_workload(connection, min_seconds, apply)
+
+
 def add_key(conn, table_name):
     return db.add_key(conn, table_name)
@@ -1,20 +1,9 @@
-from fynesse.common.db.db_setup import is_pipeline_in_progress, create_metadata_table_if_not_exists, \
-    update_metadata_on_start_pipeline, update_metadata_on_end_pipeline
-from fynesse.common.pipelines.add_census_data import init_add_census_data
-from fynesse.common.pipelines.beach import init_beach_pipeline
-from fynesse.common.pipelines.beach_intersects_msoa import init_beach_intersects_msoa
-from fynesse.common.pipelines.create_gif_for_million_postcodes import \
-    init_create_gif_for_million_postcodes
-from fynesse.common.pipelines.get_indicators import init_get_indicators, resume_get_indicators
-from fynesse.common.pipelines.part_1 import init_part_1
-from fynesse.common.pipelines.part_1_nssec_msoa import init_part_1_nssec_msoa
-from fynesse.common.pipelines.postcode import init_postcode
-from fynesse.common.pipelines.price_paid import init_price_paid, resume_price_paid
-from fynesse.common.pipelines.process_postcode import init_process_postcodes, \
-    resume_process_postcodes
-from fynesse.common.pipelines.relate_postcode_price_paid import init_relate_postcode_price_paid
-from fynesse.common.pipelines.upload_work_type_relationships import \
-    init_upload_work_type_relationships
+from fynesse.common.db.db_setup import ConnectionPool, is_pipeline_in_progress, \
+    create_metadata_table_if_not_exists, update_metadata_on_start_pipeline, \
+    update_metadata_on_end_pipeline
+from fynesse.common.db.db_profile import profile_stage, is_profiling, persist_profile
+from fynesse.common.pipelines.scheduler import PipelineSpec, run_pipelines, run_init, run_resume, \
+    resolve_entry_point
 
 PRICE_PAID_PIPELINE = "price_paid"
 PART_1_PIPELINE = "part_1"
@@ -29,13 +18,81 @@ PROCESS_POSTCODES = "process_postcodes"
 UPLOAD_WORK_TYPE_RELATIONS = "upload_work_type_relationships"
 RELATE_POSTCODE_PRICE_PAID_PIPELINE = "relate_postcode_price_paid"
 CREATE_GIF_FOR_MILLION_POSTCODES = "create_gif_for_million_postcodes"
+PRICE_PAID_UPDATE = "price_paid_update"
+
+# Loaded outside the pipelines, so they are read but never rebuilt by the scheduler.
+EXTERNAL_TABLES = ("oa", "msoa")
+
+PIPELINE_MODULE = "fynesse.common.pipelines"
+
+PIPELINES = {spec.name: spec for spec in [
+        PipelineSpec(PRICE_PAID_PIPELINE, f"{PIPELINE_MODULE}.price_paid:init_price_paid",
+                     f"{PIPELINE_MODULE}.price_paid:resume_price_paid",
+                     outputs=("price_paid",)
+                     ),
+        PipelineSpec(PART_1_PIPELINE, f"{PIPELINE_MODULE}.part_1:init_part_1",
+                     outputs=("nssec_oa", "sexual_orientation_msoa", "geography_oa",
+                              "geography_msoa", "nssec_oa_geog", "sexual_orientation_msoa_geog")
+                     ),
+        PipelineSpec(PART_1_NSSEC_MSOA_PIPELINE,
+                     f"{PIPELINE_MODULE}.part_1_nssec_msoa:init_part_1_nssec_msoa",
+                     inputs=("sexual_orientation_msoa_geog",),
+                     outputs=("nssec_msoa", "sexual_orientation_nssec_msoa_geog")
+                     ),
+        PipelineSpec(GET_INDICATORS_OA, f"{PIPELINE_MODULE}.get_indicators:init_get_indicators",
+                     f"{PIPELINE_MODULE}.get_indicators:resume_get_indicators",
+                     inputs=("nssec_oa_geog",), outputs=("poi_counts_oa",),
+                     arguments={"old_table": "nssec_oa_geog", "new_table": "poi_counts_oa"}
+                     ),
+        PipelineSpec(GET_INDICATORS_MSOA, f"{PIPELINE_MODULE}.get_indicators:init_get_indicators",
+                     f"{PIPELINE_MODULE}.get_indicators:resume_get_indicators",
+                     inputs=("sexual_orientation_nssec_msoa_geog",), outputs=("poi_counts_msoa",),
+                     arguments={"old_table": "sexual_orientation_nssec_msoa_geog",
+                                "new_table": "poi_counts_msoa"}
+                     ),
+        PipelineSpec(POSTCODE_PIPELINE, f"{PIPELINE_MODULE}.postcode:init_postcode",
+                     outputs=("postcode",)
+                     ),
+        PipelineSpec(ADD_CENSUS_DATA_PIPELINE,
+                     f"{PIPELINE_MODULE}.add_census_data:init_add_census_data",
+                     inputs=("oa", "msoa"), outputs=("oa", "msoa")
+                     ),
+        PipelineSpec(BEACH_PIPELINE, f"{PIPELINE_MODULE}.beach:init_beach_pipeline",
+                     inputs=("oa",), outputs=("beach", "beach_intersects_oa")
+                     ),
+        PipelineSpec(BEACH_INTERSECTS_MSOA,
+                     f"{PIPELINE_MODULE}.beach_intersects_msoa:init_beach_intersects_msoa",
+                     inputs=("msoa", "beach", "beach_intersects_oa"),
+                     outputs=("beach_intersects_msoa",)
+                     ),
+        PipelineSpec(PROCESS_POSTCODES, f"{PIPELINE_MODULE}.process_postcode:init_process_postcodes",
+                     f"{PIPELINE_MODULE}.process_postcode:resume_process_postcodes",
+                     inputs=("postcode", "beach"), outputs=("postcode_near_beach",)
+                     ),
+        PipelineSpec(UPLOAD_WORK_TYPE_RELATIONS,
+                     f"{PIPELINE_MODULE}.upload_work_type_relationships:"
+                     f"init_upload_work_type_relationships",
+                     outputs=("hours_worked_by_detailed_work_type", "hours_worked_by_work_type",
+                              "distance_travelled_by_detailed_work_type",
+                              "distance_travelled_by_work_type")
+                     ),
+        PipelineSpec(RELATE_POSTCODE_PRICE_PAID_PIPELINE,
+                     f"{PIPELINE_MODULE}.relate_postcode_price_paid:init_relate_postcode_price_paid",
+                     inputs=("price_paid", "postcode"), outputs=("price_paid",)
+                     ),
+        PipelineSpec(CREATE_GIF_FOR_MILLION_POSTCODES,
+                     f"{PIPELINE_MODULE}.create_gif_for_million_postcodes:"
+                     f"init_create_gif_for_million_postcodes",
+                     inputs=("price_paid", "postcode", "postcode_near_beach")
+                     ),
+]}
 
 
 def restart_pipeline(connection, pipeline_name):
     create_metadata_table_if_not_exists(connection)
 
     in_progress, last_start_time, last_end_time = is_pipeline_in_progress(connection,
-                                                                          PRICE_PAID_PIPELINE
+                                                                          pipeline_name
                                                                           )
     if in_progress:
         print(
@@ -63,44 +120,8 @@ def init_pipeline(connection, pipeline_name):
 
     update_metadata_on_start_pipeline(connection, pipeline_name)
 
-    if pipeline_name == PRICE_PAID_PIPELINE:
-        init_price_paid(connection)
-
-    if pipeline_name == PART_1_PIPELINE:
-        init_part_1(connection)
-
-    if pipeline_name == PART_1_NSSEC_MSOA_PIPELINE:
-        init_part_1_nssec_msoa(connection)
-
-    if pipeline_name == GET_INDICATORS_OA:
-        init_get_indicators(connection, "nssec_oa_geog", "poi_counts_oa")
-
-    if pipeline_name == GET_INDICATORS_MSOA:
-        init_get_indicators(connection, "sexual_orientation_nssec_msoa_geog", "poi_counts_msoa")
-
-    if pipeline_name == POSTCODE_PIPELINE:
-        init_postcode(connection)
-
-    if pipeline_name == ADD_CENSUS_DATA_PIPELINE:
-        init_add_census_data(connection)
-
-    if pipeline_name == BEACH_PIPELINE:
-        init_beach_pipeline(connection)
-
-    if pipeline_name == BEACH_INTERSECTS_MSOA:
-        init_beach_intersects_msoa(connection)
-
-    if pipeline_name == PROCESS_POSTCODES:
-        init_process_postcodes(connection)
-
-    if pipeline_name == UPLOAD_WORK_TYPE_RELATIONS:
-        init_upload_work_type_relationships(connection)
-
-    if pipeline_name == RELATE_POSTCODE_PRICE_PAID_PIPELINE:
-        init_relate_postcode_price_paid(connection)
-
-    if pipeline_name == CREATE_GIF_FOR_MILLION_POSTCODES:
-        init_create_gif_for_million_postcodes(connection)
+    with profile_stage(f"init_{pipeline_name}"):
+        run_init(connection, PIPELINES[pipeline_name])
 
 
 def resume_pipeline(connection, pipeline_name, progress_check=True):
@@ -119,16 +140,30 @@ def resume_pipeline(connection, pipeline_name, progress_check=True):
             else:
                 return
 
-    if pipeline_name == PRICE_PAID_PIPELINE:
-        resume_price_paid(connection)
+    with profile_stage(f"resume_{pipeline_name}"):
+        run_resume(connection, PIPELINES[pipeline_name])
 
-    if pipeline_name == GET_INDICATORS_OA:
-        resume_get_indicators(connection, "nssec_oa_geog", "poi_counts_oa")
+    update_metadata_on_end_pipeline(connection, pipeline_name)
 
-    if pipeline_name == GET_INDICATORS_MSOA:
-        resume_get_indicators(connection, "sexual_orientation_nssec_msoa_geog", "poi_counts_msoa")
+    if is_profiling():
+        persist_profile(connection, pipeline_name)
 
-    if pipeline_name == PROCESS_POSTCODES:
-        resume_process_postcodes(connection)
 
-    update_metadata_on_end_pipeline(connection, pipeline_name)
+def run_all_pipelines(connection, targets=None, workers=4, force=False):
+    with ConnectionPool.from_connection(connection, size=workers) as pool:
+        return run_pipelines(pool, PIPELINES, targets, EXTERNAL_TABLES, force)
+
+
+def update_price_paid(connection, **kwargs):
+    # Applied in place outside the scheduler, so price_paid keeps its pipeline end time and the
+    # tables built from it aren't considered stale.
+    create_metadata_table_if_not_exists(connection)
+    update_metadata_on_start_pipeline(connection, PRICE_PAID_UPDATE)
+
+    with profile_stage(PRICE_PAID_UPDATE):
+        resolve_entry_point(f"{PIPELINE_MODULE}.price_paid:update_price_paid")(connection, **kwargs)
+
+    update_metadata_on_end_pipeline(connection, PRICE_PAID_UPDATE)
+
+    if is_profiling():
+        persist_profile(connection, PRICE_PAID_UPDATE)
@@ -14,9 +14,13 @@ def upload_to_database(connection: Connection, table_name: str, df: pd.DataFrame
     return db_operations.upload_to_database(connection, table_name, df, temporary)
 
 
-def join_in_place(connection, table_name, df_to_join, on):
-    return db_operations.join_in_place(connection, table_name, df_to_join, on)
+def join_in_place(connection, table_name, dfs_to_join, on):
+    return db_operations.join_in_place(connection, table_name, dfs_to_join, on)
 
 
 def append_to_database(connection: Connection, table_name: str, df: pd.DataFrame):
     return db_operations.append_to_database(connection, table_name, df)
+
+
+def convert_to_native_geometry(connection: Connection, table_name: str, column_name="geometry"):
+    return db_operations.convert_to_native_geometry(connection, table_name, column_name)
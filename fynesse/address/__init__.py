@@ -10,6 +10,7 @@ from ipywidgets import interact, widgets
 
 from fynesse.assess import predict
 from fynesse.common.db.db import run_query
+from fynesse.common.db.db_cache import run_cached_query
 from fynesse.common.db.db_index_management import add_index
 
 
@@ -232,13 +233,14 @@ def oa_to_proportions(oas):
     return oas
 
 
-def get_areas_with_and_without_beaches(connection, level: Union["oa", "msoa"]):
-    areas = run_query(connection, f"""
+def get_areas_with_and_without_beaches(connection, level: Union["oa", "msoa"], use_cache=False):
+    query_function = run_cached_query if use_cache else run_query
+    areas = query_function(connection, f"""
     SELECT
         *
     FROM {level} a
     LEFT JOIN beach_intersects_{level} b ON a.id = b.{level}_id;
-    """)
+    """, columnar=True)
 
     areas_with_beach = areas[areas['beach_id'].notnull()]
     areas_with_beach = areas_with_beach.groupby('Geography_Code').first().reset_index()
@@ -385,8 +387,9 @@ def plot_job_info_with_and_without_beach_oa(oas_with_beach, oas_without_beach):
     axes[1].set_yticks([])
 
 
-def plot_hours_worked_by_detailed_work_type(connection):
-    df = run_query(connection, "SELECT * FROM hours_worked_by_detailed_work_type")
+def plot_hours_worked_by_detailed_work_type(connection, use_cache=False):
+    query_function = run_cached_query if use_cache else run_query
+    df = query_function(connection, "SELECT * FROM hours_worked_by_detailed_work_type")
 
     df["est_average_hours"] = (df["hours_31_to_48"] * 39 + df["hours_49_plus"] * 55 + df["hours_0_to_15"] * 7.5 + df[
         "hours_16_to_30"] * 22.5) / (
@@ -417,8 +420,9 @@ def plot_hours_worked_by_detailed_work_type(connection):
         plt.tight_layout()
 
 
-def plot_distance_travelled_by_detailed_work_type(connection):
-    df = run_query(connection, "SELECT * FROM distance_travelled_by_detailed_work_type")
+def plot_distance_travelled_by_detailed_work_type(connection, use_cache=False):
+    query_function = run_cached_query if use_cache else run_query
+    df = query_function(connection, "SELECT * FROM distance_travelled_by_detailed_work_type")
 
     df['est_average_distance'] = (
                                          df['distance_less_than_5km'] * 2.5 +
@@ -462,8 +466,9 @@ def plot_distance_travelled_by_detailed_work_type(connection):
         plt.tight_layout()
 
 
-def plot_hours_worked_by_work_type(connection):
-    df = run_query(connection, "SELECT * FROM hours_worked_by_work_type")
+def plot_hours_worked_by_work_type(connection, use_cache=False):
+    query_function = run_cached_query if use_cache else run_query
+    df = query_function(connection, "SELECT * FROM hours_worked_by_work_type")
 
     df["est_average_hours"] = (df["hours_31_to_48"] * 39 + df["hours_49_plus"] * 55 + df["hours_0_to_15"] * 7.5 + df[
         "hours_16_to_30"] * 22.5) / (
@@ -489,8 +494,9 @@ def plot_hours_worked_by_work_type(connection):
     plt.tight_layout()
 
 
-def plot_distance_travelled_by_work_type(connection):
-    df = run_query(connection, "SELECT * FROM distance_travelled_by_work_type")
+def plot_distance_travelled_by_work_type(connection, use_cache=False):
+    query_function = run_cached_query if use_cache else run_query
+    df = query_function(connection, "SELECT * FROM distance_travelled_by_work_type")
 
     df['est_average_distance'] = (
                                          df['distance_less_than_5km'] * 2.5 +
@@ -1,6 +1,5 @@
-from . import filter
-from . import map
-from . import osm
-from . import plot
-from . import predict
-from . import query
+from fynesse._lazy import lazy_submodules
+
+__all__ = ["filter", "map", "nearest", "osm", "plot", "predict", "query"]
+
+__getattr__, __dir__ = lazy_submodules(__name__, __all__)
@@ -0,0 +1,26 @@
+import geopandas as gpd
+import pandas as pd
+
+
+def nearest_features(points: gpd.GeoDataFrame, features: gpd.GeoDataFrame, max_distance=None,
+                     feature_columns=None, distance_column="distance"
+                     ) -> pd.DataFrame:
+    # Distances are in the units of the features' CRS, so use a projected one such as EPSG:27700.
+    if points.crs != features.crs:
+        points = points.to_crs(features.crs)
+
+    if feature_columns is None:
+        feature_columns = [col for col in features.columns if col != features.geometry.name]
+
+    # features.sindex is an STRtree built once per frame, so repeated batches against the same
+    # features reuse it; query_nearest returns exact distances, one nearest feature per point.
+    (point_positions, feature_positions), distances = features.sindex.nearest(
+            points.geometry.values, return_all=False, max_distance=max_distance,
+            return_distance=True
+    )
+
+    nearest = features[feature_columns].iloc[feature_positions].set_axis(
+            points.index[point_positions]
+    )
+    nearest[distance_column] = distances
+    return pd.DataFrame(nearest)
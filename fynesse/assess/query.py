@@ -1,27 +1,78 @@
 import random
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import shapely
 from pymysql import Connection
-from shapely import wkt
 
 from fynesse.common.db import db
 
 
-def run_query(conn, query, args=None, execute_many=False):
-    return db.run_query(conn, query, args, execute_many)
+def run_query(conn, query, args=None, execute_many=False, columnar=False):
+    return db.run_query(conn, query, args, execute_many, columnar)
 
 
-def database_df_to_gpd(df, geometry_column_name="geometry", crs="EPSG:27700"):
-    df[geometry_column_name] = df[geometry_column_name].apply(
-            lambda x: wkt.loads(x) if pd.notnull(x) else None
-    )
-    df = gpd.GeoDataFrame(df, geometry=geometry_column_name, crs=crs)
-    df.to_crs("EPSG:4326", inplace=True)
+def run_query_in_chunks(conn, query, args=None, chunk_size=100_000, columnar=False):
+    return db.run_query_in_chunks(conn, query, args, chunk_size, columnar)
+
+
+def database_df_to_gpd(df, geometry_column_name="geometry", crs="EPSG:27700",
+                       target_crs="EPSG:4326"
+                       ):
+    values = df[geometry_column_name].to_numpy(dtype=object)
+    values = np.where(pd.isnull(values), None, values)
+
+    # DuckDB returns BLOB columns as bytearrays, which shapely doesn't accept.
+    if any(isinstance(value, bytearray) for value in values):
+        values = np.array([bytes(value) if value is not None else None for value in values],
+                          dtype=object
+                          )
+
+    if any(isinstance(value, bytes) for value in values):
+        geometries = shapely.from_wkb(values)
+    else:
+        geometries = shapely.from_wkt(values)
+
+    df = gpd.GeoDataFrame(df.assign(**{geometry_column_name: geometries}),
+                          geometry=geometry_column_name, crs=crs
+                          )
+
+    if target_crs is not None:
+        df = df.to_crs(target_crs)
     return df
 
 
+def database_chunks_to_gpd(chunks, geometry_column_name="geometry", crs="EPSG:27700",
+                           target_crs="EPSG:4326"
+                           ):
+    for chunk in chunks:
+        yield database_df_to_gpd(chunk, geometry_column_name, crs, target_crs)
+
+
+def query_intersecting_bbox(connection, table_name, min_x, min_y, max_x, max_y, columns="*",
+                            geometry_column_name="geometry", crs="EPSG:27700"
+                            ):
+    bbox = shapely.box(min_x, min_y, max_x, max_y).wkt
+
+    df = run_query(connection, f"""
+        SELECT {columns}, ST_AsWKB({geometry_column_name}) AS {geometry_column_name}_wkb
+        FROM {table_name}
+        WHERE MBRIntersects({geometry_column_name}, ST_GeomFromText('{bbox}'))
+    """
+                   )
+    df = df.drop(columns=[geometry_column_name], errors="ignore").rename(
+            columns={f"{geometry_column_name}_wkb": geometry_column_name}
+    )
+    return database_df_to_gpd(df, geometry_column_name, crs, target_crs=None)
+
+
 def random_sample(connection, table_name, sample_number):
+    if db.is_local_connection(connection):
+        return run_query(connection,
+                         f"SELECT * FROM {table_name} USING SAMPLE reservoir({sample_number} ROWS)"
+                         )
+
     count = run_query(connection, f"SELECT COUNT(*) FROM {table_name}").iloc[0, 0]
     sample_indexes = random.sample(range(count), sample_number)
 
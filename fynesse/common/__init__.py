@@ -1,2 +1,5 @@
-from . import db
-from . import pipelines
+from fynesse._lazy import lazy_submodules
+
+__all__ = ["db", "pipelines"]
+
+__getattr__, __dir__ = lazy_submodules(__name__, __all__)
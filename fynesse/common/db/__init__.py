@@ -1,4 +1,8 @@
-from . import db
-from . import db_index_management
-from . import db_operations
-from . import db_setup
+from fynesse._lazy import lazy_submodules
+
+__all__ = [
+        "db", "db_advisor", "db_cache", "db_index_management", "db_operations",
+        "db_profile", "db_setup", "db_work_queue"
+]
+
+__getattr__, __dir__ = lazy_submodules(__name__, __all__)
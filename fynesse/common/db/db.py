@@ -1,29 +1,226 @@
-from typing import Union
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Union
 
+import numpy as np
 import pandas as pd
 from pymysql import Connection
+from pymysql.constants import FIELD_TYPE, FLAG
+from pymysql.cursors import SSCursor
 
+INTEGER_FIELD_TYPES = {FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.INT24, FIELD_TYPE.LONG,
+                       FIELD_TYPE.LONGLONG, FIELD_TYPE.YEAR}
+FLOAT_FIELD_TYPES = {FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL, FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE}
+DATE_FIELD_TYPES = {FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE, FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP}
+CATEGORICAL_FIELD_TYPES = {FIELD_TYPE.ENUM, FIELD_TYPE.SET}
 
-def run_query(connection: Connection, query: str, args=None, execute_many: bool = False
+# String literals are matched too so that placeholders are only rewritten outside them.
+PLACEHOLDER_PATTERN = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|%s")
+
+# Connections with an open transaction(), by id, whose writes are committed when it exits.
+_open_transactions = set()
+
+# Set per thread by answer_prompts(); while unset, prompts ask on stdin.
+_prompt_answers = threading.local()
+
+# Set by db_profile while profiling is enabled; called as (query, args, result, seconds).
+query_recorder = None
+
+
+def _column_to_array(values, type_code: int, flags: int):
+    if type_code in INTEGER_FIELD_TYPES:
+        # UNSIGNED BIGINT goes up to 2**64 - 1, past what int64 holds.
+        unsigned_bigint = flags & FLAG.UNSIGNED and type_code == FIELD_TYPE.LONGLONG
+        if None in values:
+            return pd.array(values, dtype="UInt64" if unsigned_bigint else "Int64")
+        if unsigned_bigint:
+            return np.fromiter(values, dtype=np.uint64, count=len(values))
+        if flags & FLAG.UNSIGNED:
+            return np.fromiter(values, dtype=np.uint32, count=len(values))
+        return np.fromiter(values, dtype=np.int64, count=len(values))
+
+    if type_code in FLOAT_FIELD_TYPES:
+        return np.array(values, dtype=np.float64)
+
+    if type_code in DATE_FIELD_TYPES:
+        # pymysql returns values it can't parse, such as the zero date '0000-00-00', as strings.
+        values = [None if isinstance(value, str) else value for value in values]
+        return pd.to_datetime(pd.Series(values, dtype=object), errors="coerce").to_numpy()
+
+    # MariaDB reports ENUM columns as strings with the ENUM flag set.
+    if type_code in CATEGORICAL_FIELD_TYPES or flags & FLAG.ENUM:
+        return pd.Categorical(values)
+
+    return np.array(values, dtype=object)
+
+
+def _rows_to_columnar_df(cursor, rows) -> pd.DataFrame:
+    fields = cursor._result.fields
+    columns = list(zip(*rows)) if rows else [()] * len(fields)
+
+    df = pd.DataFrame({
+            i: _column_to_array(values, field.type_code, field.flags)
+            for i, (field, values) in enumerate(zip(fields, columns))
+    }
+    )
+    df.columns = [field.name for field in fields]
+    return df
+
+
+def _rows_to_df(cursor, rows, columnar: bool) -> pd.DataFrame:
+    if columnar:
+        return _rows_to_columnar_df(cursor, rows)
+
+    columns = [desc[0] for desc in cursor.description]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def is_local_connection(connection) -> bool:
+    # Checked by module name so duckdb is only imported by callers that open a local database.
+    return type(connection).__module__.lstrip("_").startswith("duckdb")
+
+
+def _local_placeholders(query: str, args) -> str:
+    # pymysql only substitutes %s when there are arguments, so without them the query is left as is.
+    if args is None:
+        return query
+    return PLACEHOLDER_PATTERN.sub(lambda match: "?" if match.group() == "%s" else match.group(),
+                                   query
+                                   )
+
+
+def _run_local_query(connection, query: str, args=None, execute_many: bool = False
+                     ) -> Union[pd.DataFrame, None, int]:
+    query = _local_placeholders(query, args)
+    connection.executemany(query, args) if execute_many else connection.execute(query, args)
+
+    if query.strip().lower().startswith(("select", "show", "describe")):
+        return connection.df()
+
+    elif query.strip().lower().startswith(("delete", "insert", "update")):
+        return connection.fetchone()[0]
+
+    else:
+        return None
+
+
+def in_transaction(connection) -> bool:
+    return id(connection) in _open_transactions
+
+
+@contextmanager
+def transaction(connection):
+    # Nested transactions join the outermost one rather than committing early.
+    if in_transaction(connection):
+        yield connection
+        return
+
+    connection.begin()
+    _open_transactions.add(id(connection))
+    try:
+        yield connection
+    except BaseException:
+        connection.rollback()
+        raise
+    else:
+        connection.commit()
+    finally:
+        _open_transactions.discard(id(connection))
+
+
+def run_query(connection: Connection, query: str, args=None, execute_many: bool = False,
+              columnar: bool = False, commit: bool = True
               ) -> Union[pd.DataFrame, None, int]:
+    if query_recorder is None:
+        return _execute_query(connection, query, args, execute_many, columnar, commit)
+
+    start_time = time.perf_counter()
+    result = _execute_query(connection, query, args, execute_many, columnar, commit)
+    query_recorder(query, args, result, time.perf_counter() - start_time)
+    return result
+
+
+def _execute_query(connection: Connection, query: str, args, execute_many: bool, columnar: bool,
+                   commit: bool
+                   ) -> Union[pd.DataFrame, None, int]:
+    if is_local_connection(connection):
+        return _run_local_query(connection, query, args, execute_many)
+
     with connection.cursor() as cursor:
         cursor.execute(query, args) if not execute_many else cursor.executemany(query, args)
 
         if query.strip().lower().startswith(("select", "show", "describe")):
-            rows = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description]
-            return pd.DataFrame(rows, columns=columns)
+            return _rows_to_df(cursor, cursor.fetchall(), columnar)
 
         elif query.strip().lower().startswith(
-                ("delete", "insert", "update", "drop", "create", "alter", "kill")
+                ("delete", "insert", "update", "drop", "create", "alter", "kill", "load")
         ):
-            connection.commit()
+            if commit and not in_transaction(connection):
+                connection.commit()
             return cursor.rowcount
 
         else:
             return None
 
 
+def run_query_in_chunks(connection: Connection, query: str, args=None, chunk_size: int = 100_000,
+                        columnar: bool = False
+                        ) -> Iterator[pd.DataFrame]:
+    chunks = _execute_query_in_chunks(connection, query, args, chunk_size, columnar)
+    if query_recorder is None:
+        yield from chunks
+        return
+
+    # Recorded once for the whole stream, excluding the time the caller spends between chunks.
+    seconds, rows, size = 0.0, 0, 0
+    try:
+        while True:
+            start_time = time.perf_counter()
+            chunk = next(chunks, None)
+            seconds += time.perf_counter() - start_time
+            if chunk is None:
+                break
+            rows += len(chunk)
+            size += int(chunk.memory_usage(index=False).sum())
+            yield chunk
+    finally:
+        query_recorder(query, args, (rows, size), seconds)
+
+
+def _execute_query_in_chunks(connection: Connection, query: str, args, chunk_size: int,
+                             columnar: bool
+                             ) -> Iterator[pd.DataFrame]:
+    if is_local_connection(connection):
+        connection.execute(_local_placeholders(query, args), args)
+        # DuckDB hands out whole vectors of 2048 rows, so they are buffered and sliced to size.
+        vectors_per_chunk = -(-chunk_size // 2048)
+        buffered = pd.DataFrame()
+        while True:
+            chunk = connection.fetch_df_chunk(vectors_per_chunk)
+            if len(chunk) == 0:
+                break
+            buffered = pd.concat([buffered, chunk], ignore_index=True) if len(buffered) else chunk
+            while len(buffered) >= chunk_size:
+                yield buffered.iloc[:chunk_size].reset_index(drop=True)
+                buffered = buffered.iloc[chunk_size:]
+        if len(buffered):
+            yield buffered.reset_index(drop=True)
+        return
+
+    # Unbuffered cursor: rows stay on the server until fetched, so only one chunk is held at a time.
+    # The connection can't run other queries until the generator is exhausted or closed.
+    with connection.cursor(SSCursor) as cursor:
+        cursor.execute(query, args)
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield _rows_to_df(cursor, rows, columnar)
+
+
 def kill_all_processes(connection: Connection):
     try:
         run_query(connection, "SHOW PROCESSLIST")
@@ -73,13 +270,26 @@ def print_tables_summary(conn):
             print("\nNo indices set on this table.")
 
 
+@contextmanager
+def answer_prompts(delete_tables: bool) -> Iterator[None]:
+    # Code running off the main thread can't share stdin, so it answers prompts up front instead.
+    previous = getattr(_prompt_answers, "delete_tables", None)
+    _prompt_answers.delete_tables = delete_tables
+    try:
+        yield
+    finally:
+        _prompt_answers.delete_tables = previous
+
+
 def abort_deletion_if_table_exists(connection, table_name):
     tables = run_query(connection, "SHOW TABLES")
     if table_name in tables[tables.columns[-1]].to_list():
-        delete_confirmation = input(
-                f"Table '{table_name}' already exists. Do you want to dellete the table and recreate it? (y/n): "
-        ).strip().lower()
-        if delete_confirmation in ["y", "yes"]:
+        delete_tables = getattr(_prompt_answers, "delete_tables", None)
+        if delete_tables is None:
+            delete_tables = input(
+                    f"Table '{table_name}' already exists. Do you want to dellete the table and recreate it? (y/n): "
+            ).strip().lower() in ["y", "yes"]
+        if delete_tables:
             print(f"Deleting table '{table_name}'...")
             run_query(connection, f"DROP TABLE {table_name}")
             print(f"Deleted")
@@ -89,13 +299,22 @@ def abort_deletion_if_table_exists(connection, table_name):
     return False
 
 
+def table_columns(connection, table_name) -> pd.DataFrame:
+    # MariaDB's SHOW COLUMNS shape (Field, Type, ...) on both backends; DuckDB has DESCRIBE instead.
+    if is_local_connection(connection):
+        return run_query(connection, f'DESCRIBE "{table_name}"').rename(
+                columns={"column_name": "Field", "column_type": "Type"}
+        )
+    return run_query(connection, f"SHOW COLUMNS FROM `{table_name}`")
+
+
 def column_exists(connection, table_name, column_name):
     cursor = connection.cursor()
 
     check_query = f"""
     SELECT COUNT(*)
     FROM information_schema.columns
-    WHERE table_schema = DATABASE()
+    WHERE table_schema = {"current_schema()" if is_local_connection(connection) else "DATABASE()"}
     AND table_name = '{table_name}'
     AND column_name = '{column_name}';
     """
@@ -105,5 +324,13 @@ def column_exists(connection, table_name, column_name):
 
 
 def add_key(conn, table_name):
-    if not column_exists(conn, table_name, "id"):
+    if column_exists(conn, table_name, "id"):
+        return
+
+    if is_local_connection(conn):
+        run_query(conn, f"CREATE SEQUENCE IF NOT EXISTS {table_name}_id_seq")
+        run_query(conn,
+                  f"ALTER TABLE {table_name} ADD COLUMN id INTEGER DEFAULT nextval('{table_name}_id_seq')"
+                  )
+    else:
         run_query(conn, f"ALTER TABLE {table_name} ADD COLUMN id INT AUTO_INCREMENT PRIMARY KEY;")
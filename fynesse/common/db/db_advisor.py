@@ -0,0 +1,244 @@
+import json
+import re
+import threading
+from typing import Union
+
+import pandas as pd
+from pymysql import Connection
+
+from ..db.db import is_local_connection
+from ..db.db_index_management import existing_indexes, apply_index_plan
+from ..db.db_profile import (fingerprint_sql, profile_examples, add_query_listener,
+                             remove_query_listener, is_profiling, enable_profiling)
+from ..db.db_setup import ConnectionPool
+
+MIN_SCANNED_ROWS = 1_000
+
+TABLE_ALIAS_PATTERN = re.compile(
+        r"\b(?:from|join)\s+`?(\w+)`?(?:\s+(?:as\s+)?`?(?!(?:on|using|where|join|inner|left|right|"
+        r"cross|natural|straight_join|group|order|limit|union|having)\b)(\w+)`?)?",
+        re.IGNORECASE
+)
+COLUMN_REFERENCE = r"`?(?:(\w+)`?\.`?)?([a-z_]\w*)`?"
+COMPARISON_PATTERN = re.compile(
+        rf"{COLUMN_REFERENCE}\s*(<=>|<=|>=|<>|!=|=|<|>|\bin\b|\blike\b|\bbetween\b)\s*"
+        rf"(?:{COLUMN_REFERENCE})?",
+        re.IGNORECASE
+)
+ORDER_BY_PATTERN = re.compile(r"\border\s+by\s+(.+?)(?:\blimit\b|\)|$)", re.IGNORECASE | re.DOTALL)
+EQUALITY_OPERATORS = {"=", "<=>", "in"}
+
+_explaining = threading.local()
+
+
+def explain_query(connection: Connection, query: str, args=None) -> Union[dict, None]:
+    if is_local_connection(connection):
+        return None
+    if not query.strip().lower().startswith(("select", "update", "delete")):
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN FORMAT=JSON {query}", args)
+        return json.loads(cursor.fetchone()[0])
+
+
+def _walk_plan(node, under_filesort: bool = False):
+    if isinstance(node, list):
+        for child in node:
+            yield from _walk_plan(child, under_filesort)
+        return
+
+    if not isinstance(node, dict):
+        return
+
+    # MariaDB nests sorted tables under a "filesort" node; MySQL flags the ordering operation.
+    under_filesort = under_filesort or "filesort" in node or node.get("using_filesort") is True
+
+    if "table_name" in node:
+        yield node, under_filesort
+
+    for child in node.values():
+        yield from _walk_plan(child, under_filesort)
+
+
+def find_plan_problems(plan: dict, min_scanned_rows: int = MIN_SCANNED_ROWS) -> list:
+    problems = []
+    for position, (table, filesort) in enumerate(_walk_plan(plan)):
+        rows = table.get("rows", table.get("rows_examined_per_scan", 0)) or 0
+        full_scan = table.get("access_type") == "ALL" and rows >= min_scanned_rows
+
+        if full_scan or filesort:
+            problems.append({
+                    "alias": table["table_name"],
+                    "driving": position == 0,
+                    "access_type": table.get("access_type"),
+                    "rows": rows,
+                    "full_scan": full_scan,
+                    "filesort": filesort,
+                    "condition": table.get("attached_condition"),
+            })
+    return problems
+
+
+def table_aliases(query: str) -> dict:
+    aliases = {}
+    for table, alias in TABLE_ALIAS_PATTERN.findall(query):
+        aliases[table.lower()] = table
+        if alias:
+            aliases[alias.lower()] = table
+    return aliases
+
+
+def _columns_for_alias(query: str, alias: str, aliases: dict, driving: bool) -> tuple:
+    single_table = len(set(aliases.values())) == 1
+    matches = lambda qualifier: (qualifier.lower() == alias.lower() if qualifier else single_table)
+
+    equality_columns, range_columns = [], []
+    for left_qualifier, left, operator, right_qualifier, right in COMPARISON_PATTERN.findall(query):
+        is_join = bool(right_qualifier)
+        # The driving table is scanned before any join, so only its filters can use an index.
+        if is_join and driving:
+            continue
+
+        columns = equality_columns if operator.lower() in EQUALITY_OPERATORS else range_columns
+        if matches(left_qualifier):
+            columns.append(left.lower())
+        if is_join and matches(right_qualifier):
+            columns.append(right.lower())
+
+    order_columns = []
+    for clause in ORDER_BY_PATTERN.findall(query):
+        for term in clause.split(","):
+            match = re.match(COLUMN_REFERENCE, term.strip(), re.IGNORECASE)
+            if match and matches(match.group(1)):
+                order_columns.append(match.group(2).lower())
+
+    return equality_columns, range_columns, order_columns
+
+
+def _index_for(equality_columns: list, range_columns: list, order_columns: list) -> tuple:
+    # Equality columns lead; then the range column, or failing that the sort columns, so the index
+    # can serve both the lookup and the ORDER BY.
+    trailing = range_columns[:1] if range_columns else order_columns
+    if range_columns and order_columns and order_columns[0] == range_columns[0]:
+        trailing = order_columns
+
+    return tuple(dict.fromkeys(equality_columns + trailing))
+
+
+def _is_covered(index: tuple, indexes: dict) -> bool:
+    return any(existing[:len(index)] == index for existing in indexes.values())
+
+
+def suggest_indexes(connection: Connection, query: str, args=None,
+                    min_scanned_rows: int = MIN_SCANNED_ROWS
+                    ) -> list:
+    plan = explain_query(connection, query, args)
+    if plan is None:
+        return []
+
+    aliases = table_aliases(query)
+    suggestions = []
+    for problem in find_plan_problems(plan, min_scanned_rows):
+        table = aliases.get(problem["alias"].lower())
+        if table is None:
+            continue
+
+        index = _index_for(*_columns_for_alias(query, problem["alias"], aliases,
+                                               problem["driving"]
+                                               ))
+        if not index or _is_covered(index, existing_indexes(connection, table)):
+            continue
+
+        reasons = [reason for reason, flagged in [("full scan", problem["full_scan"]),
+                                                  ("filesort", problem["filesort"])] if flagged]
+        suggestions.append({
+                "table": table,
+                "columns": index,
+                "reason": " and ".join(reasons),
+                "rows": problem["rows"],
+                "fingerprint": fingerprint_sql(query),
+        })
+    return suggestions
+
+
+def apply_suggestions(connection: Connection, suggestions: list) -> dict:
+    index_plan = {}
+    for suggestion in suggestions:
+        indexes = index_plan.setdefault(suggestion["table"], [])
+        if suggestion["columns"] not in indexes:
+            indexes.append(suggestion["columns"])
+
+    return apply_index_plan(connection, index_plan)
+
+
+def advise_workload(connection: Connection, min_seconds: float = 0.5, apply: bool = False,
+                    min_scanned_rows: int = MIN_SCANNED_ROWS
+                    ) -> pd.DataFrame:
+    suggestions = []
+    for fingerprint, (seconds, query, args) in profile_examples().items():
+        if seconds < min_seconds:
+            continue
+        try:
+            suggestions += suggest_indexes(connection, query, args, min_scanned_rows)
+        except Exception as e:
+            print(f"Could not explain {fingerprint}: {e}")
+
+    suggestions = pd.DataFrame(suggestions,
+                               columns=["table", "columns", "reason", "rows", "fingerprint"]
+                               ).drop_duplicates(subset=["table", "columns"], ignore_index=True)
+
+    for suggestion in suggestions.itertuples(index=False):
+        print(f"Suggest index on {suggestion.table} ({', '.join(suggestion.columns)}): "
+              f"{suggestion.reason} over {suggestion.rows} rows in {suggestion.fingerprint}"
+              )
+
+    if apply and len(suggestions) > 0:
+        apply_suggestions(connection, suggestions.to_dict("records"))
+
+    return suggestions
+
+
+def start_live_advisor(connection: Connection, min_seconds: float = 1.0, apply: bool = False,
+                       min_scanned_rows: int = MIN_SCANNED_ROWS
+                       ):
+    # Statements complete on any pooled connection, possibly while that connection still streams
+    # a result, so EXPLAIN runs on a dedicated connection of its own. Its single slot also keeps
+    # listeners on different threads from using it at once.
+    pool = (None if is_local_connection(connection)
+            else ConnectionPool.from_connection(connection, size=1))
+    seen = set()
+
+    def advise(query, args, seconds):
+        fingerprint = fingerprint_sql(query)
+        if pool is None or getattr(_explaining, "active", False) or fingerprint in seen:
+            return
+        seen.add(fingerprint)
+
+        _explaining.active = True
+        try:
+            with pool.connection() as advisor_connection:
+                suggestions = suggest_indexes(advisor_connection, query, args, min_scanned_rows)
+                for suggestion in suggestions:
+                    print(f"Slow query ({seconds:.1f}s) would benefit from an index on "
+                          f"{suggestion['table']} ({', '.join(suggestion['columns'])}): "
+                          f"{suggestion['reason']}"
+                          )
+                if apply and suggestions:
+                    apply_suggestions(advisor_connection, suggestions)
+        except Exception as e:
+            print(f"Could not explain {fingerprint}: {e}")
+        finally:
+            _explaining.active = False
+
+    advise.pool = pool
+    if not is_profiling():
+        enable_profiling()
+    add_query_listener(advise, min_seconds)
+    return advise
+
+
+def stop_live_advisor(advisor) -> None:
+    remove_query_listener(advisor)
+    if advisor.pool is not None:
+        advisor.pool.close()
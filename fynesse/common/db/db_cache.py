@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import re
+import warnings
+from typing import Union
+
+import pandas as pd
+from pymysql import Connection
+
+from ..db.db import run_query, is_local_connection
+
+CACHE_DIRECTORY = os.path.join("fetched_data", "query_cache")
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+
+ALIAS_STOP_WORDS = ["join", "inner", "left", "right", "cross", "straight_join", "natural", "on",
+                   "using", "where", "group", "having", "order", "limit", "union", "window", "for",
+                   "lock", "into"]
+TABLE_REFERENCE = (r"(?:`?\w+`?\.)?`?\w+`?"
+                   rf"(?:\s+(?:as\s+)?(?!(?:{'|'.join(ALIAS_STOP_WORDS)})\b)\w+)?")
+# FROM can list several comma-separated tables, each with an optional alias.
+TABLE_REFERENCE_PATTERN = re.compile(
+        rf"\b(?:from|join)\s+({TABLE_REFERENCE}(?:\s*,\s*{TABLE_REFERENCE})*)", re.IGNORECASE
+)
+PARENTHESES_PATTERN = re.compile(r"\(([^()]*)\)")
+SUBQUERY = " __subquery__ "
+
+
+def normalise_sql(query: str) -> str:
+    return " ".join(query.strip().rstrip(";").split())
+
+
+def referenced_tables(query: str) -> list:
+    # Parenthesised parts are parsed on their own and replaced by a placeholder, innermost first,
+    # so a derived table at the head of a FROM list doesn't hide the tables listed after it.
+    parts = []
+    while True:
+        remaining = PARENTHESES_PATTERN.sub(lambda match: parts.append(match.group(1)) or SUBQUERY,
+                                            query
+                                            )
+        if remaining == query:
+            break
+        query = remaining
+    parts.append(query)
+
+    # Anything picked up that isn't a table (e.g. EXTRACT(YEAR FROM col)) has no version, so
+    # _table_versions then refuses to cache rather than risk a stale result.
+    tables = {reference.split()[0].replace("`", "").split(".")[-1].lower()
+              for part in parts
+              for references in TABLE_REFERENCE_PATTERN.findall(part)
+              for reference in references.split(",")}
+    return sorted(tables - {SUBQUERY.strip()})
+
+
+def _table_versions(connection: Connection, tables: list, use_checksum: bool
+                    ) -> Union[list, None]:
+    placeholders = ", ".join(["%s"] * len(tables))
+    versions = run_query(connection, f"""
+        SELECT LOWER(TABLE_NAME) AS table_name, CREATE_TIME, UPDATE_TIME,
+               UPDATE_TIME IS NULL OR UPDATE_TIME >= NOW() - INTERVAL 1 SECOND AS unreliable
+        FROM information_schema.tables
+        WHERE table_schema = DATABASE()
+        AND LOWER(TABLE_NAME) IN ({placeholders})
+        ORDER BY table_name
+    """, tables
+                         )
+
+    # Temporary tables (e.g. sample_ids) don't appear in information_schema, so their contents
+    # can't be versioned and the result must not be cached.
+    if len(versions) != len(tables):
+        return None
+
+    # UPDATE_TIME is NULL after a restart and only has one-second granularity, so a NULL or a
+    # write in the last second would give the same key as an earlier, different table state.
+    if not use_checksum and versions["unreliable"].astype(bool).any():
+        return None
+
+    versions = [[str(value) for value in row]
+                for row in versions.drop(columns="unreliable").itertuples(index=False)]
+
+    if use_checksum:
+        with connection.cursor() as cursor:
+            cursor.execute(f"CHECKSUM TABLE {', '.join(f'`{table}`' for table in tables)}")
+            versions += [[str(value) for value in row] for row in cursor.fetchall()]
+
+    return versions
+
+
+def _evict(cache_directory: str, max_cache_bytes: int) -> None:
+    entries = [os.path.join(cache_directory, file) for file in os.listdir(cache_directory)
+               if file.endswith(".parquet")]
+    entries.sort(key=os.path.getmtime)
+
+    total_bytes = sum(os.path.getsize(entry) for entry in entries)
+    for entry in entries:
+        if total_bytes <= max_cache_bytes:
+            break
+        total_bytes -= os.path.getsize(entry)
+        os.remove(entry)
+
+
+def run_cached_query(connection: Connection, query: str, args=None, columnar: bool = False,
+                     use_checksum: bool = False, cache_directory: str = CACHE_DIRECTORY,
+                     max_cache_bytes: int = MAX_CACHE_BYTES
+                     ) -> Union[pd.DataFrame, None, int]:
+    # DuckDB doesn't expose table modification times, and scanning its files locally is already
+    # cheap enough that caching buys nothing.
+    if is_local_connection(connection) or not query.strip().lower().startswith("select"):
+        return run_query(connection, query, args, columnar=columnar)
+
+    tables = referenced_tables(query)
+    versions = _table_versions(connection, tables, use_checksum) if tables else None
+    if versions is None:
+        return run_query(connection, query, args, columnar=columnar)
+
+    key = hashlib.sha256(
+            json.dumps([normalise_sql(query), repr(args), columnar, versions]).encode("utf-8")
+    ).hexdigest()
+    path = os.path.join(cache_directory, f"{key}.parquet")
+
+    if os.path.exists(path):
+        os.utime(path)
+        return pd.read_parquet(path, engine="pyarrow")
+
+    df = run_query(connection, query, args, columnar=columnar)
+
+    os.makedirs(cache_directory, exist_ok=True)
+    try:
+        df.to_parquet(f"{path}.tmp", engine="pyarrow", index=False)
+        os.replace(f"{path}.tmp", path)
+    except Exception as e:
+        warnings.warn(f"Could not cache query result: {e}")
+        if os.path.exists(f"{path}.tmp"):
+            os.remove(f"{path}.tmp")
+        return df
+
+    _evict(cache_directory, max_cache_bytes)
+    return df
+
+
+def clear_query_cache(cache_directory: str = CACHE_DIRECTORY) -> None:
+    if not os.path.exists(cache_directory):
+        return
+
+    for file in os.listdir(cache_directory):
+        if file.endswith(".parquet"):
+            os.remove(os.path.join(cache_directory, file))
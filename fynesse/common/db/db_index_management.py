@@ -1,23 +1,40 @@
-from ..db.db import run_query
+import time
+
+from ..db.db import run_query, is_local_connection
+from ..db.db_setup import ConnectionPool
 
 
 def index_exists(connection, table_name, index_name):
     cursor = connection.cursor()
 
-    check_query = f"""
-    SELECT COUNT(*)
-    FROM information_schema.statistics
-    WHERE table_schema = DATABASE()
-    AND table_name = '{table_name}'
-    AND index_name = '{index_name}';
-    """
+    if is_local_connection(connection):
+        check_query = f"""
+        SELECT COUNT(*)
+        FROM duckdb_indexes()
+        WHERE table_name = '{table_name}'
+        AND index_name = '{index_name}';
+        """
+    else:
+        check_query = f"""
+        SELECT COUNT(*)
+        FROM information_schema.statistics
+        WHERE table_schema = DATABASE()
+        AND table_name = '{table_name}'
+        AND index_name = '{index_name}';
+        """
 
     cursor.execute(check_query)
     return cursor.fetchone()[0] != 0
 
 
+def _index_name(connection, table_name, column_names):
+    # DuckDB index names are unique per schema rather than per table.
+    prefix = f"{table_name}_" if is_local_connection(connection) else ""
+    return f"{prefix}{'_'.join(column_names)}_idx"
+
+
 def add_index(connection, table_name, column_name):
-    index_name = f"{column_name}_idx"
+    index_name = _index_name(connection, table_name, [column_name])
 
     if index_exists(connection, table_name, index_name):
         print(f"index {index_name} already exists on {table_name}")
@@ -27,10 +44,73 @@ def add_index(connection, table_name, column_name):
 
 
 def add_multiple_indexes(connection, table_name, column_names):
-    index_name = f"{'_'.join(column_names)}_idx"
+    index_name = _index_name(connection, table_name, column_names)
 
     if index_exists(connection, table_name, index_name):
         print(f"index {index_name} already exists on {table_name}")
         return
 
     run_query(connection, f"CREATE INDEX {index_name} ON {table_name} ({', '.join(column_names)})")
+
+
+def _index_columns(index) -> list:
+    return [index] if isinstance(index, str) else list(index)
+
+
+def _bare_column_name(column: str) -> str:
+    return column.split("(")[0].strip("` ")
+
+
+def existing_indexes(connection, table_name) -> dict:
+    indexes = run_query(connection, f"SHOW INDEX FROM {table_name}")
+    indexes = indexes.sort_values(["Key_name", "Seq_in_index"])
+
+    return {
+            key_name: tuple(column.lower() for column in group["Column_name"])
+            for key_name, group in indexes.groupby("Key_name", sort=False)
+    }
+
+
+def apply_table_index_plan(connection, table_name, indexes) -> float:
+    if is_local_connection(connection):
+        start_time = time.perf_counter()
+        for index in indexes:
+            add_multiple_indexes(connection, table_name, _index_columns(index))
+        return time.perf_counter() - start_time
+
+    existing = existing_indexes(connection, table_name)
+    existing_names = {key_name.lower() for key_name in existing}
+    existing_column_sets = set(existing.values())
+
+    add_clauses = []
+    for index in indexes:
+        column_names = _index_columns(index)
+        index_name = f"{'_'.join(_bare_column_name(col) for col in column_names)}_idx"
+        column_set = tuple(_bare_column_name(col).lower() for col in column_names)
+
+        if index_name.lower() in existing_names or column_set in existing_column_sets:
+            print(f"index {index_name} already exists on {table_name}")
+            continue
+
+        add_clauses.append(f"ADD INDEX {index_name} ({', '.join(column_names)})")
+
+    if not add_clauses:
+        return 0.0
+
+    start_time = time.perf_counter()
+    run_query(connection, f"ALTER TABLE {table_name} {', '.join(add_clauses)}")
+    elapsed = time.perf_counter() - start_time
+
+    print(f"Added {len(add_clauses)} indexes to {table_name} in {elapsed:.1f}s")
+    return elapsed
+
+
+def apply_index_plan(connection, index_plan: dict, parallel: bool = False) -> dict:
+    if not parallel or len(index_plan) < 2:
+        return {table_name: apply_table_index_plan(connection, table_name, indexes)
+                for table_name, indexes in index_plan.items()}
+
+    with ConnectionPool.from_connection(connection, size=len(index_plan)) as pool:
+        elapsed = pool.run_concurrently(apply_table_index_plan, index_plan.items())
+
+    return dict(zip(index_plan, elapsed))
@@ -1,9 +1,149 @@
+import os
+import tempfile
+import warnings
+from functools import reduce
+
 import geopandas as gpd
 import pandas as pd
 from pandas.io.sql import get_schema
 from pymysql import Connection
+from pymysql.err import DataError
+
+from ..db.db import (abort_deletion_if_table_exists, run_query, is_local_connection, table_columns,
+                     transaction)
+
+LOAD_DATA_CHUNK_ROWS = 100_000
+JOIN_IN_PLACE_CHUNK_ROWS = 20_000
+SPATIAL_COLUMN_TYPES = ("geometry", "point", "linestring", "polygon", "multipoint",
+                        "multilinestring", "multipolygon", "geometrycollection")
+
+
+def _is_geometry_column(column: pd.Series) -> bool:
+    return isinstance(column.dtype, gpd.array.GeometryDtype)
+
+
+def _serialise_column_for_load(column: pd.Series, as_wkb: bool = False) -> pd.Series:
+    if _is_geometry_column(column) and as_wkb:
+        text = gpd.GeoSeries(column).to_wkb(hex=True)
+    elif _is_geometry_column(column):
+        text = gpd.GeoSeries(column).to_wkt()
+    elif pd.api.types.is_bool_dtype(column):
+        text = column.astype("Int64").astype(str)
+    elif pd.api.types.infer_dtype(column, skipna=True) == "boolean":
+        # Object columns of booleans (e.g. with missing values) would load as 'True', which is 0.
+        text = column.map({True: "1", False: "0"})
+    elif pd.api.types.is_datetime64_any_dtype(column):
+        text = column.dt.strftime("%Y-%m-%d %H:%M:%S")
+    elif pd.api.types.is_numeric_dtype(column):
+        text = column.astype(str)
+    else:
+        # LOAD DATA's default ESCAPED BY '\\' reads these sequences back as the original characters.
+        text = (column.astype(str)
+                .str.replace("\\", "\\\\", regex=False)
+                .str.replace("\t", "\\t", regex=False)
+                .str.replace("\n", "\\n", regex=False)
+                .str.replace("\r", "\\r", regex=False))
+
+    return text.mask(column.isna(), "\\N")
+
+
+def _write_df_as_tsv(df: pd.DataFrame, file, wkb_columns=()) -> None:
+    for start in range(0, len(df), LOAD_DATA_CHUNK_ROWS):
+        chunk = df.iloc[start:start + LOAD_DATA_CHUNK_ROWS]
+        columns = [_serialise_column_for_load(chunk[col], as_wkb=col in wkb_columns)
+                   for col in chunk.columns]
+        lines = columns[0].str.cat(columns[1:], sep="\t") if len(columns) > 1 else columns[0]
+        file.write("\n".join(lines))
+        file.write("\n")
+
+
+def load_df_into_table(connection: Connection, table_name: str, df: pd.DataFrame) -> None:
+    if len(df) == 0:
+        return
+
+    columns = table_columns(connection, table_name)
+    spatial = columns["Type"].str.lower().str.startswith(SPATIAL_COLUMN_TYPES)
+    spatial_columns = set(columns[spatial]["Field"])
+
+    # Spatial indexes need NOT NULL geometry columns, which would reject the whole load.
+    required_geometry = [col for col in columns[spatial & (columns["Null"] == "NO")]["Field"]
+                         if col in df.columns]
+    missing_geometry = df[required_geometry].isna().any(axis=1) if required_geometry else None
+    if missing_geometry is not None and missing_geometry.any():
+        warnings.warn(f"Dropping {missing_geometry.sum()} of {len(df)} rows with no geometry "
+                      f"from {table_name}"
+                      )
+        df = df[~missing_geometry]
+        if len(df) == 0:
+            return
+
+    load_columns = []
+    set_clauses = []
+    wkb_columns = set()
+    for i, col in enumerate(df.columns):
+        if col in spatial_columns and _is_geometry_column(df[col]):
+            load_columns.append(f"@geometry_{i}")
+            set_clauses.append(f"`{col}` = ST_GeomFromWKB(UNHEX(@geometry_{i}))")
+            wkb_columns.add(col)
+        elif col in spatial_columns:
+            load_columns.append(f"@geometry_{i}")
+            set_clauses.append(f"`{col}` = ST_GeomFromText(@geometry_{i})")
+        else:
+            load_columns.append(f"`{col}`")
+
+    set_clause = f"SET {', '.join(set_clauses)}" if set_clauses else ""
 
-from ..db.db import abort_deletion_if_table_exists, run_query
+    with tempfile.NamedTemporaryFile("w", suffix=".tsv", encoding="utf-8", newline="",
+                                     delete=False
+                                     ) as file:
+        _write_df_as_tsv(df, file, wkb_columns)
+
+    # LOCAL loads downgrade data errors (truncation, bad values) to warnings, which are only
+    # visible until the next statement, so they are read before the transaction commits.
+    try:
+        with transaction(connection):
+            loaded_rows = run_query(connection, f"""
+                LOAD DATA LOCAL INFILE '{file.name.replace(os.sep, "/")}'
+                INTO TABLE `{table_name}` CHARACTER SET utf8mb4
+                FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+                LINES TERMINATED BY '\\n'
+                ({', '.join(load_columns)})
+                {set_clause}
+            """
+                                    )
+            load_warnings = run_query(connection, "SHOW WARNINGS")
+            load_warnings = load_warnings[load_warnings["Level"].isin(["Warning", "Error"])]
+            if loaded_rows != len(df) or len(load_warnings):
+                raise DataError(f"Loaded {loaded_rows} of {len(df)} rows into {table_name} with "
+                                f"{len(load_warnings)} warnings: "
+                                f"{'; '.join(load_warnings['Message'].head(5))}"
+                                )
+    finally:
+        os.remove(file.name)
+
+
+def _to_local_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # DuckDB stores geometry as WKB blobs, the same bytes ST_AsWKB returns from MariaDB.
+    geometry_columns = [col for col in df.columns if _is_geometry_column(df[col])]
+    return pd.DataFrame(df).assign(
+            **{col: gpd.GeoSeries(df[col]).to_wkb() for col in geometry_columns}
+    )
+
+
+def _upload_to_local_database(connection, table_name: str, df: pd.DataFrame, temporary: bool,
+                              append: bool
+                              ) -> None:
+    connection.register("upload_frame", _to_local_frame(df))
+    try:
+        if append:
+            run_query(connection, f"INSERT INTO {table_name} BY NAME SELECT * FROM upload_frame")
+        else:
+            table_type = "TEMPORARY" if temporary else ""
+            run_query(connection,
+                      f"CREATE {table_type} TABLE IF NOT EXISTS {table_name} AS SELECT * FROM upload_frame"
+                      )
+    finally:
+        connection.unregister("upload_frame")
 
 
 def upload_to_database(connection: Connection, table_name: str, df: pd.DataFrame,
@@ -12,29 +152,58 @@ def upload_to_database(connection: Connection, table_name: str, df: pd.DataFrame
     if abort_deletion_if_table_exists(connection, table_name):
         return
 
-    is_gdf = isinstance(df, gpd.GeoDataFrame)
+    if is_local_connection(connection):
+        _upload_to_local_database(connection, table_name, df, temporary, append=False)
+        return
+
+    geometry_columns = [col for col in df.columns if _is_geometry_column(df[col])]
 
     table_type = "TEMPORARY" if temporary else ""
     create_table_query = (get_schema(df, table_name)
                           .replace("CREATE TABLE", f"CREATE {table_type} TABLE IF NOT EXISTS", 1)
                           .replace('"', '`'))
 
-    if is_gdf:
-        create_table_query = create_table_query.replace(
-                "`geometry` VARCHAR(255)", "`geometry` GEOMETRY"
-        )
+    for col in geometry_columns:
+        create_table_query = create_table_query.replace(f"`{col}` TEXT",
+                                                        f"`{col}` GEOMETRY NOT NULL"
+                                                        )
 
     run_query(connection, create_table_query)
 
-    values_placeholders = ", ".join(["%s"] * len(df.columns))
-    columns = ', '.join([f"`{col}`" for col in df.columns])
-    insert_query = f"INSERT INTO {table_name} ({columns}) VALUES ({values_placeholders})"
+    load_df_into_table(connection, table_name, df)
+
+    # InnoDB doesn't support spatial indexes on temporary tables.
+    if not temporary:
+        for col in geometry_columns:
+            run_query(connection,
+                      f"ALTER TABLE {table_name} ADD SPATIAL INDEX {col}_spatial_idx (`{col}`)"
+                      )
 
-    if is_gdf:
-        df["geometry"] = df["geometry"].apply(lambda geometry: geometry.wkt if geometry else None)
 
-    run_query(connection, insert_query, [tuple(record) for record in df.to_records(index=False)],
-              execute_many=True
+def convert_to_native_geometry(connection: Connection, table_name: str,
+                               column_name: str = "geometry"
+                               ) -> None:
+    # The local backend already stores geometry as WKB blobs.
+    if is_local_connection(connection):
+        return
+
+    column_type = run_query(connection, f"SHOW COLUMNS FROM {table_name} LIKE '{column_name}'")
+    if column_type.iloc[0]["Type"].lower().startswith(SPATIAL_COLUMN_TYPES):
+        return
+
+    print(f"Converting {table_name}.{column_name} from WKT text to GEOMETRY...")
+    run_query(connection,
+              f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS `{column_name}_native` GEOMETRY"
+              )
+    run_query(connection,
+              f"UPDATE {table_name} SET `{column_name}_native` = ST_GeomFromText(`{column_name}`)"
+              )
+    run_query(connection, f"""
+        ALTER TABLE {table_name}
+        DROP COLUMN `{column_name}`,
+        CHANGE `{column_name}_native` `{column_name}` GEOMETRY NOT NULL,
+        ADD SPATIAL INDEX {column_name}_spatial_idx (`{column_name}`)
+    """
               )
 
 
@@ -43,19 +212,10 @@ def append_to_database(connection: Connection, table_name: str, df: pd.DataFrame
 
     if table_name not in tables[tables.columns[-1]].to_list():
         upload_to_database(connection, table_name, df)
+    elif is_local_connection(connection):
+        _upload_to_local_database(connection, table_name, df, temporary=False, append=True)
     else:
-        is_gdf = isinstance(df, gpd.GeoDataFrame)
-
-        values_placeholders = ", ".join(["%s"] * len(df.columns))
-        columns = ', '.join([f"`{col}`" for col in df.columns])
-        insert_query = f"INSERT INTO {table_name} ({columns}) VALUES ({values_placeholders})"
-
-        if is_gdf:
-            df["geometry"] = df["geometry"].apply(lambda geom: geom.wkt if geom else None)
-
-        run_query(connection, insert_query, [tuple(row) for row in df.to_records(index=False)],
-                  execute_many=True
-                  )
+        load_df_into_table(connection, table_name, df)
 
 
 def join_tables(connection: Connection, table1: str, table2: str, on: str, joined_table_name: str):
@@ -79,7 +239,45 @@ def join_tables(connection: Connection, table1: str, table2: str, on: str, joine
               )
 
 
-def join_in_place(connection, table_name, df_to_join, on):
+def _join_in_place_local(connection, table_name, df_to_join, on):
+    # DuckDB updates straight from the registered frame, so no staging table or index is needed.
+    connection.register("join_frame", _to_local_frame(df_to_join))
+    try:
+        existing_columns = table_columns(connection, table_name)["Field"].to_list()
+        frame_types = table_columns(connection, "join_frame").set_index("Field")["Type"]
+        for col in df_to_join.columns:
+            if col not in on and col not in existing_columns:
+                run_query(connection, f'ALTER TABLE {table_name} ADD COLUMN "{col}" {frame_types[col]}')
+
+        set_clause = ", ".join(
+                [f'"{col}" = source."{col}"' for col in df_to_join.columns if col not in on]
+        )
+        on_clause = " AND ".join([f'{table_name}."{col}" = source."{col}"' for col in on])
+        run_query(connection,
+                  f"UPDATE {table_name} SET {set_clause} FROM join_frame AS source WHERE {on_clause}"
+                  )
+    finally:
+        connection.unregister("join_frame")
+
+
+def join_in_place(connection, table_name, dfs_to_join, on, chunk_size=JOIN_IN_PLACE_CHUNK_ROWS):
+    if isinstance(dfs_to_join, pd.DataFrame):
+        dfs_to_join = [dfs_to_join]
+
+    # merge would otherwise keep both copies of a shared column as new _x/_y columns.
+    seen_columns = set()
+    for df in dfs_to_join:
+        overlap = seen_columns & (set(df.columns) - set(on))
+        if overlap:
+            raise ValueError(f"Columns {sorted(overlap)} appear in more than one frame to join")
+        seen_columns |= set(df.columns) - set(on)
+
+    df_to_join = reduce(lambda left, right: left.merge(right, on=on, how="outer"), dfs_to_join)
+
+    if is_local_connection(connection):
+        _join_in_place_local(connection, table_name, df_to_join, on)
+        return
+
     upload_to_database(connection, "temporary", df_to_join, temporary=True)
 
     schema = get_schema(df_to_join, "temporary").replace('"', '`')
@@ -89,23 +287,77 @@ def join_in_place(connection, table_name, df_to_join, on):
             for line in schema.split('\n') if '(' not in line and ')' not in line
     }
 
-    for column_name, column_type in column_definitions.items():
-        if column_name not in on:
-            run_query(connection,
-                      f"ALTER TABLE {table_name} ADD COLUMN `{column_name}` {column_type}"
-                      )
+    # TEXT columns can only be indexed on a prefix.
+    staging_index_columns = ", ".join(
+            [f"`{col}`(64)" if column_definitions[col] == "TEXT" else f"`{col}`" for col in on]
+    )
+    run_query(connection,
+              f"ALTER TABLE temporary ADD INDEX temporary_on_idx ({staging_index_columns})"
+              )
+
+    existing_columns = table_columns(connection, table_name)["Field"].to_list()
+    new_columns = [f"ADD COLUMN `{column_name}` {column_type}"
+                   for column_name, column_type in column_definitions.items()
+                   if column_name not in on and column_name not in existing_columns]
 
-    on_clause = " AND ".join([f"target.{col} = temp.{col}" for col in on])
+    if new_columns:
+        run_query(connection, f"ALTER TABLE {table_name} {', '.join(new_columns)}")
+
+    on_clause = " AND ".join([f"target.`{col}` = temp.`{col}`" for col in on])
     set_clause = ", ".join(
-            [f"target.{col} = temp.{col}" for col in df_to_join.columns if col not in on]
+            [f"target.`{col}` = temp.`{col}`" for col in df_to_join.columns if col not in on]
     )
-
-    run_query(connection, f"""
+    update_query = f"""
         UPDATE {table_name} AS target
         JOIN temporary AS temp
         ON {on_clause}
         SET {set_clause}
     """
+
+    if "id" not in existing_columns:
+        run_query(connection, update_query)
+        run_query(connection, "DROP table temporary")
+        return
+
+    id_range = run_query(connection,
+                         f"SELECT MIN(id) AS min_id, MAX(id) AS max_id FROM {table_name}"
+                         )
+    min_id, max_id = id_range.iloc[0]["min_id"], id_range.iloc[0]["max_id"]
+
+    # Each id range commits with its checkpoint, so an interrupted join of the same columns
+    # carries on after the last range that completed.
+    progress_table_name = f"{table_name}_join_progress"
+    joined_columns = ",".join(sorted(col for col in df_to_join.columns if col not in on))
+    run_query(connection, f"""
+        CREATE TABLE IF NOT EXISTS {progress_table_name} (
+            id INTEGER PRIMARY KEY, joined_columns TEXT NOT NULL, last_id BIGINT NOT NULL
+        )
+    """
               )
+    progress = run_query(connection,
+                         f"SELECT joined_columns, last_id FROM {progress_table_name} WHERE id = 1"
+                         )
+    if len(progress) and progress.iloc[0]["joined_columns"] == joined_columns:
+        min_id = max(min_id, int(progress.iloc[0]["last_id"]) + 1)
+        print(f"Resuming join into {table_name} from id {min_id}")
+    else:
+        run_query(connection, f"DELETE FROM {progress_table_name}")
+        run_query(connection,
+                  f"INSERT INTO {progress_table_name} (id, joined_columns, last_id) VALUES (1, %s, -1)",
+                  [joined_columns]
+                  )
+
+    if pd.notnull(min_id):
+        for start_id in range(int(min_id), int(max_id) + 1, chunk_size):
+            end_id = start_id + chunk_size - 1
+            with transaction(connection):
+                run_query(connection,
+                          f"{update_query} WHERE target.id BETWEEN {start_id} AND {end_id}"
+                          )
+                run_query(connection, f"UPDATE {progress_table_name} SET last_id = %s WHERE id = 1",
+                          [end_id]
+                          )
+            print(f"Joined into {table_name} up to id {min(end_id, int(max_id))} of {int(max_id)}")
 
+    run_query(connection, f"DROP TABLE {progress_table_name}")
     run_query(connection, "DROP table temporary")
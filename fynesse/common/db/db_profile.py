@@ -0,0 +1,234 @@
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, Union
+
+import pandas as pd
+from pymysql import Connection
+
+from ..db import db
+from ..db.db_cache import normalise_sql
+
+PROFILE_TABLE = "pipeline_profile"
+
+LITERAL_PATTERN = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|\b\d+(?:\.\d+)?\b")
+IN_LIST_PATTERN = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+DB_PACKAGE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+QUERY_WRAPPER_FILES = {os.path.join(os.path.dirname(os.path.dirname(DB_PACKAGE_DIRECTORY)),
+                                    "assess", "query.py")}
+
+_records = []
+_records_lock = threading.Lock()
+_stages = threading.local()
+
+# Slowest raw (seconds, query, args) seen per fingerprint, so recorded statements can be re-run
+# under EXPLAIN.
+_examples = {}
+
+# (listener, min_seconds) pairs called with (query, args, seconds) for each slow enough statement.
+_listeners = []
+
+
+def fingerprint_sql(query: str) -> str:
+    fingerprint = LITERAL_PATTERN.sub("?", normalise_sql(query).replace("%s", "?"))
+    return IN_LIST_PATTERN.sub("(?+)", fingerprint).lower()
+
+
+def _current_stage() -> Union[str, None]:
+    stack = getattr(_stages, "stack", None)
+    return stack[-1] if stack else None
+
+
+def _caller() -> str:
+    frame = sys._getframe(2)
+    while frame is not None:
+        file_name = os.path.abspath(frame.f_code.co_filename)
+        if os.path.dirname(file_name) != DB_PACKAGE_DIRECTORY and file_name not in QUERY_WRAPPER_FILES:
+            return f"{frame.f_globals.get('__name__')}:{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+
+def _size_of_args(args) -> int:
+    return len(repr(args)) if args is not None else 0
+
+
+def _record_query(query: str, args, result, seconds: float) -> None:
+    if isinstance(result, pd.DataFrame):
+        rows, bytes_received = len(result), int(result.memory_usage(index=False).sum())
+    elif isinstance(result, tuple):
+        rows, bytes_received = result
+    else:
+        rows, bytes_received = result or 0, 0
+
+    fingerprint = fingerprint_sql(query)
+    record = {
+            "fingerprint": fingerprint,
+            "seconds": seconds,
+            "rows": rows,
+            "bytes": len(query) + _size_of_args(args) + bytes_received,
+            "stage": _current_stage(),
+            "caller": _caller(),
+            "recorded_at": time.time(),
+    }
+    with _records_lock:
+        _records.append(record)
+        if seconds > _examples.get(fingerprint, (-1.0,))[0]:
+            _examples[fingerprint] = (seconds, query, args)
+        listeners = [listener for listener, min_seconds in _listeners if seconds >= min_seconds]
+
+    for listener in listeners:
+        listener(query, args, seconds)
+
+
+def add_query_listener(listener, min_seconds: float = 0.0) -> None:
+    with _records_lock:
+        _listeners.append((listener, min_seconds))
+
+
+def remove_query_listener(listener) -> None:
+    with _records_lock:
+        _listeners[:] = [(other, min_seconds) for other, min_seconds in _listeners
+                         if other is not listener]
+
+
+def enable_profiling(reset: bool = True) -> None:
+    if reset:
+        reset_profile()
+    db.query_recorder = _record_query
+
+
+def disable_profiling() -> None:
+    db.query_recorder = None
+
+
+def is_profiling() -> bool:
+    return db.query_recorder is not None
+
+
+def reset_profile() -> None:
+    with _records_lock:
+        _records.clear()
+        _examples.clear()
+
+
+def profile_examples() -> dict:
+    with _records_lock:
+        return dict(_examples)
+
+
+@contextmanager
+def profile_stage(stage: str) -> Iterator[None]:
+    if not hasattr(_stages, "stack"):
+        _stages.stack = []
+
+    _stages.stack.append(stage)
+    try:
+        yield
+    finally:
+        _stages.stack.pop()
+
+
+@contextmanager
+def profiling(reset: bool = True) -> Iterator[None]:
+    enable_profiling(reset)
+    try:
+        yield
+    finally:
+        disable_profiling()
+
+
+def profile_records() -> pd.DataFrame:
+    with _records_lock:
+        records = list(_records)
+    return pd.DataFrame(records, columns=["fingerprint", "seconds", "rows", "bytes", "stage",
+                                          "caller", "recorded_at"]
+                        )
+
+
+def profile_summary(sort_by: str = "total_seconds", top: Union[int, None] = 20) -> pd.DataFrame:
+    records = profile_records()
+
+    summary = records.groupby(["fingerprint", "stage", "caller"], dropna=False).agg(
+            count=("seconds", "size"),
+            total_seconds=("seconds", "sum"),
+            mean_seconds=("seconds", "mean"),
+            max_seconds=("seconds", "max"),
+            rows=("rows", "sum"),
+            bytes=("bytes", "sum"),
+    ).reset_index()
+
+    summary = summary.sort_values(sort_by, ascending=False, ignore_index=True)
+    return summary.head(top) if top is not None else summary
+
+
+def print_profile(top: int = 10) -> None:
+    print(f"Top {top} statements by total time:")
+    print(profile_summary("total_seconds", top)[["count", "total_seconds", "stage", "fingerprint"]])
+    print(f"\nTop {top} statements by count:")
+    print(profile_summary("count", top)[["count", "total_seconds", "stage", "fingerprint"]])
+
+
+def export_profile(path: str, summary: bool = True) -> None:
+    df = profile_summary(top=None) if summary else profile_records()
+
+    if path.endswith(".json"):
+        df.to_json(path, orient="records", indent=2)
+    elif path.endswith(".csv"):
+        df.to_csv(path, index=False)
+    else:
+        raise ValueError(f"Unsupported profile format for {path}, expected .csv or .json")
+
+    print(f"Exported {len(df)} profile rows to {path}")
+
+
+def create_profile_table_if_not_exists(connection: Connection) -> None:
+    db.run_query(connection, f"""
+                    CREATE TABLE IF NOT EXISTS {PROFILE_TABLE} (
+                        run_name VARCHAR(255) NOT NULL,
+                        recorded_at DATETIME NOT NULL,
+                        stage VARCHAR(255),
+                        caller VARCHAR(255),
+                        fingerprint TEXT NOT NULL,
+                        query_count BIGINT NOT NULL,
+                        total_seconds DOUBLE NOT NULL,
+                        max_seconds DOUBLE NOT NULL,
+                        row_count BIGINT NOT NULL,
+                        byte_count BIGINT NOT NULL
+                    );
+                """
+                 )
+
+
+def persist_profile(connection: Connection, run_name: str) -> None:
+    summary = profile_summary(top=None)
+    if len(summary) == 0:
+        return
+
+    recorder, db.query_recorder = db.query_recorder, None
+    try:
+        create_profile_table_if_not_exists(connection)
+
+        recorded_at = datetime.utcnow().replace(microsecond=0)
+        rows = [
+                (run_name, recorded_at, row.stage if pd.notna(row.stage) else None, row.caller,
+                 row.fingerprint, int(row.count), float(row.total_seconds), float(row.max_seconds),
+                 int(row.rows), int(row.bytes))
+                for row in summary.itertuples(index=False)
+        ]
+        db.run_query(connection, f"""
+                    INSERT INTO {PROFILE_TABLE} (run_name, recorded_at, stage, caller, fingerprint,
+                                                 query_count, total_seconds, max_seconds, row_count,
+                                                 byte_count)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, rows, execute_many=True
+                     )
+    finally:
+        db.query_recorder = recorder
+
+    print(f"Persisted {len(rows)} profile rows for {run_name} to {PROFILE_TABLE}")
@@ -1,11 +1,17 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Union, Optional, Tuple
+from typing import Union, Optional, Tuple, Iterator
 
 import pandas as pd
 import pymysql
 from pymysql import Connection
 
-from ..db.db import abort_deletion_if_table_exists, run_query
+from ..db.db import abort_deletion_if_table_exists, column_exists, run_query
 
 
 def initialise_database(db_name: str, user: str, password: str, host: str, port: int = 3306
@@ -40,6 +46,125 @@ def create_connection(user: str, password: str, host: str, database: Union[str,
     return connection
 
 
+LOCAL_DATABASE_PATH = "fetched_data/local.duckdb"
+
+
+def create_local_connection(path: str = LOCAL_DATABASE_PATH):
+    import duckdb
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    connection = duckdb.connect(path)
+
+    # Geometry is kept as WKB blobs, so the MariaDB conversion functions used by the pipelines are
+    # identities here.
+    connection.execute("CREATE OR REPLACE MACRO ST_AsWKB(geometry) AS geometry")
+    connection.execute("CREATE OR REPLACE MACRO ST_GeomFromWKB(geometry) AS geometry")
+
+    return connection
+
+
+def _as_str(value):
+    return value.decode("latin1") if isinstance(value, bytes) else value
+
+
+def _close_quietly(connection: Connection) -> None:
+    try:
+        connection.close()
+    except pymysql.MySQLError:
+        pass
+
+
+class ConnectionPool:
+    def __init__(self, user: str, password: str, host: str, database: Union[str, None],
+                 port: int = 3306, size: int = 4, health_check_after_seconds: float = 30
+                 ):
+        self.connection_info = {"user"    : user, "password": password, "host": host,
+                                "database": database, "port": port}
+        self.size = size
+        self.health_check_after_seconds = health_check_after_seconds
+
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+
+    @classmethod
+    def from_connection(cls, connection: Connection, size: int = 4) -> "ConnectionPool":
+        return cls(_as_str(connection.user), _as_str(connection.password), connection.host,
+                   _as_str(connection.db), connection.port, size
+                   )
+
+    def _open(self) -> Connection:
+        connection = create_connection(**self.connection_info)
+        if connection is None:
+            raise ConnectionError(f"Could not open a connection to {self.connection_info['host']}")
+        return connection
+
+    def _checkout(self) -> Connection:
+        while True:
+            try:
+                connection, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._open()
+
+            if time.monotonic() - last_used < self.health_check_after_seconds:
+                return connection
+
+            try:
+                connection.ping(reconnect=True)
+                return connection
+            except pymysql.MySQLError:
+                _close_quietly(connection)
+
+    @contextmanager
+    def connection(self) -> Iterator[Connection]:
+        self._slots.acquire()
+        connection = None
+        try:
+            connection = self._checkout()
+            yield connection
+        except Exception:
+            if connection is not None:
+                try:
+                    connection.rollback()
+                except pymysql.MySQLError:
+                    _close_quietly(connection)
+                    connection = None
+            raise
+        finally:
+            if connection is not None:
+                self._idle.put((connection, time.monotonic()))
+            self._slots.release()
+
+    def run_concurrently(self, function, arguments_list) -> list:
+        def run(arguments):
+            with self.connection() as connection:
+                return function(connection, *arguments)
+
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return list(executor.map(run, arguments_list))
+
+    def close(self) -> None:
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            _close_quietly(connection)
+
+    def __enter__(self) -> "ConnectionPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def create_connection_pool(user: str, password: str, host: str, database: Union[str, None],
+                           port: int = 3306, size: int = 4
+                           ) -> ConnectionPool:
+    return ConnectionPool(user, password, host, database, port, size)
+
+
 def initialise_metadata_table(connection: Connection) -> None:
     if abort_deletion_if_table_exists(connection, "pipeline_metadata"):
         return
@@ -48,7 +173,8 @@ def initialise_metadata_table(connection: Connection) -> None:
                                         CREATE TABLE pipeline_metadata (
                                             pipeline_name VARCHAR(255) PRIMARY KEY,
                                             last_pipeline_start DATETIME NOT NULL  DEFAULT CURRENT_TIMESTAMP,
-                                            last_pipeline_end DATETIME
+                                            last_pipeline_end DATETIME,
+                                            last_duration_seconds DOUBLE
                                         );
                                     """
               )
@@ -59,10 +185,14 @@ def create_metadata_table_if_not_exists(connection: Connection) -> None:
                                         CREATE TABLE IF NOT EXISTS pipeline_metadata (
                                             pipeline_name VARCHAR(255) PRIMARY KEY,
                                             last_pipeline_start DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                                            last_pipeline_end DATETIME
+                                            last_pipeline_end DATETIME,
+                                            last_duration_seconds DOUBLE
                                         );
                                     """
               )
+    # Tables created before durations were recorded are migrated once.
+    if not column_exists(connection, "pipeline_metadata", "last_duration_seconds"):
+        run_query(connection, "ALTER TABLE pipeline_metadata ADD COLUMN last_duration_seconds DOUBLE")
 
 
 def is_pipeline_in_progress(connection: Connection, pipeline_name: str) -> Tuple[
@@ -80,7 +210,7 @@ def is_pipeline_in_progress(connection: Connection, pipeline_name: str) -> Tuple
     if len(result) > 0 and result["last_pipeline_start"].values[0]:
         last_start = result["last_pipeline_start"].values[0]
         last_end = result["last_pipeline_end"].values[0]
-        in_progress = last_end is None or last_start > last_end
+        in_progress = pd.isnull(last_end) or last_start > last_end
         return in_progress, last_start, last_end
 
     return False, None, None
@@ -98,13 +228,23 @@ def update_metadata_on_start_pipeline(connection: Connection, pipeline_name: str
               )
 
 
-def update_metadata_on_end_pipeline(connection: Connection, pipeline_name: str) -> None:
+def update_metadata_on_end_pipeline(connection: Connection, pipeline_name: str,
+                                    duration_seconds: Optional[float] = None
+                                    ) -> None:
     curr_time = datetime.utcnow()
 
     run_query(connection, f"""
-                                        INSERT INTO pipeline_metadata (pipeline_name, last_pipeline_end)
-                                        VALUES ('{pipeline_name}', '{curr_time}')
+                                        INSERT INTO pipeline_metadata (pipeline_name, last_pipeline_end, last_duration_seconds)
+                                        VALUES ('{pipeline_name}', '{curr_time}', %s)
                                         ON DUPLICATE KEY UPDATE 
-                                            last_pipeline_end = '{curr_time}';
-                                    """
+                                            last_pipeline_end = '{curr_time}',
+                                            last_duration_seconds = %s;
+                                    """, [duration_seconds, duration_seconds]
               )
+
+
+def pipeline_metadata(connection: Connection) -> pd.DataFrame:
+    metadata = run_query(connection, "SELECT * FROM pipeline_metadata")
+    metadata["last_pipeline_start"] = pd.to_datetime(metadata["last_pipeline_start"])
+    metadata["last_pipeline_end"] = pd.to_datetime(metadata["last_pipeline_end"])
+    return metadata.set_index("pipeline_name")
@@ -0,0 +1,281 @@
+import multiprocessing
+import os
+import socket
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, NamedTuple, Protocol, Union
+
+import pandas as pd
+from pymysql import Connection
+
+from ..db.db import (run_query, transaction, abort_deletion_if_table_exists,
+                     is_local_connection)
+from ..db.db_index_management import add_index
+from ..db.db_setup import ConnectionPool
+
+LEASE_SECONDS = 15 * 60
+
+
+class Lease(NamedTuple):
+    lease_id: int
+    start_order: int
+    end_order: int
+    worker_id: str
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class BatchSizer(Protocol):
+    def start_batch(self) -> int: ...
+
+    def finish_batch(self, rows: int) -> int: ...
+
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def create_work_queue(connection: Connection, queue_name: str, source_table: str,
+                      shuffle: bool = True
+                      ) -> bool:
+    if abort_deletion_if_table_exists(connection, f"{queue_name}_cursor"):
+        return False
+
+    for suffix in ["indexes", "leases"]:
+        run_query(connection, f"DROP TABLE IF EXISTS {queue_name}_{suffix}")
+
+    # The ids are numbered on the server, so memory stays flat however large the source is. They
+    # can't be streamed back through this connection instead: it can't write while a stream is open.
+    random = "random()" if is_local_connection(connection) else "RAND()"
+    run_query(connection, f"""
+                CREATE TABLE {queue_name}_indexes (
+                    id BIGINT NOT NULL,
+                    random_order BIGINT NOT NULL
+                );
+            """
+              )
+    total = run_query(connection, f"""
+                INSERT INTO {queue_name}_indexes (id, random_order)
+                SELECT id, ROW_NUMBER() OVER (ORDER BY {random if shuffle else "id"}) - 1
+                FROM {source_table}
+            """
+                      )
+    add_index(connection, f"{queue_name}_indexes", "random_order")
+
+    # Leases cover half-open ranges [start_order, end_order) of random_order. New work is cut
+    # from next_order in the single cursor row; expired, incomplete leases are handed out again.
+    run_query(connection, f"""
+                CREATE TABLE {queue_name}_leases (
+                    lease_id INTEGER PRIMARY KEY AUTO_INCREMENT,
+                    start_order BIGINT NOT NULL,
+                    end_order BIGINT NOT NULL,
+                    worker_id VARCHAR(255) NOT NULL,
+                    leased_until DATETIME NOT NULL,
+                    completed BOOLEAN NOT NULL DEFAULT FALSE,
+                    INDEX completed_leased_until_idx (completed, leased_until)
+                );
+            """
+              )
+    run_query(connection, f"""
+                CREATE TABLE {queue_name}_cursor (
+                    id INTEGER PRIMARY KEY,
+                    next_order BIGINT NOT NULL,
+                    total BIGINT NOT NULL
+                );
+            """
+              )
+    run_query(connection, f"INSERT INTO {queue_name}_cursor (id, next_order, total) VALUES (1, 0, %s)",
+              [total]
+              )
+    print(f"Created work queue {queue_name} with {total} items")
+    return True
+
+
+def drop_work_queue(connection: Connection, queue_name: str) -> None:
+    for suffix in ["cursor", "leases", "indexes"]:
+        run_query(connection, f"DROP TABLE IF EXISTS {queue_name}_{suffix}")
+
+
+def claim_batch(connection: Connection, queue_name: str, batch_size: int, worker_id: str,
+                lease_seconds: int = LEASE_SECONDS
+                ) -> Union[Lease, None]:
+    with transaction(connection):
+        # SKIP LOCKED lets concurrent workers pass over a lease another worker is reclaiming.
+        expired = run_query(connection, f"""
+                    SELECT lease_id, start_order, end_order
+                    FROM {queue_name}_leases
+                    WHERE completed = FALSE AND leased_until < NOW()
+                    ORDER BY lease_id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                """
+                            )
+        if len(expired) > 0:
+            lease_id, start_order, end_order = (int(value) for value in expired.iloc[0])
+            run_query(connection, f"""
+                        UPDATE {queue_name}_leases
+                        SET worker_id = %s, leased_until = NOW() + INTERVAL %s SECOND
+                        WHERE lease_id = %s
+                    """, [worker_id, lease_seconds, lease_id]
+                      )
+            print(f"{worker_id} reclaimed expired lease {lease_id} [{start_order}, {end_order})")
+            return Lease(lease_id, start_order, end_order, worker_id)
+
+        cursor = run_query(connection,
+                           f"SELECT next_order, total FROM {queue_name}_cursor WHERE id = 1 FOR UPDATE"
+                           )
+        start_order, total = (int(value) for value in cursor.iloc[0])
+        if start_order >= total:
+            return None
+
+        end_order = min(start_order + batch_size, total)
+        run_query(connection, f"UPDATE {queue_name}_cursor SET next_order = %s WHERE id = 1",
+                  [end_order]
+                  )
+        run_query(connection, f"""
+                    INSERT INTO {queue_name}_leases (start_order, end_order, worker_id, leased_until)
+                    VALUES (%s, %s, %s, NOW() + INTERVAL %s SECOND)
+                """, [start_order, end_order, worker_id, lease_seconds]
+                  )
+        lease_id = int(run_query(connection, "SELECT LAST_INSERT_ID()").iloc[0, 0])
+
+    return Lease(lease_id, start_order, end_order, worker_id)
+
+
+def complete_batch(connection: Connection, queue_name: str, lease: Lease) -> None:
+    # Must run inside the same transaction as the batch's result writes; if the lease has since
+    # been reclaimed by another worker, raising here rolls those writes back.
+    completed = run_query(connection, f"""
+                UPDATE {queue_name}_leases
+                SET completed = TRUE
+                WHERE lease_id = %s AND worker_id = %s AND completed = FALSE
+            """, [lease.lease_id, lease.worker_id]
+                          )
+    if completed != 1:
+        raise LeaseLost(f"Lease {lease.lease_id} was reclaimed before {lease.worker_id} finished")
+
+
+def fetch_batch(connection: Connection, queue_name: str, source_table: str, lease: Lease,
+                columnar: bool = False
+                ) -> pd.DataFrame:
+    return run_query(connection, f"""
+                SELECT o.random_order, t.*
+                FROM {queue_name}_indexes o
+                JOIN {source_table} t ON o.id = t.id
+                WHERE o.random_order >= %s AND o.random_order < %s
+                ORDER BY o.random_order
+            """, [lease.start_order, lease.end_order], columnar=columnar
+                     )
+
+
+def queue_status(connection: Connection, queue_name: str) -> dict:
+    cursor = run_query(connection, f"SELECT next_order, total FROM {queue_name}_cursor WHERE id = 1")
+    leases = run_query(connection, f"""
+                SELECT
+                    COALESCE(SUM(completed), 0) AS completed,
+                    COALESCE(SUM(NOT completed), 0) AS outstanding,
+                    TIMESTAMPDIFF(SECOND, NOW(), MIN(CASE WHEN NOT completed THEN leased_until END))
+                        AS seconds_to_next_expiry
+                FROM {queue_name}_leases
+            """
+                       )
+    return {
+            "next_order"            : int(cursor.iloc[0, 0]),
+            "total"                 : int(cursor.iloc[0, 1]),
+            "completed_leases"      : int(leases.iloc[0, 0]),
+            "outstanding_leases"    : int(leases.iloc[0, 1]),
+            "seconds_to_next_expiry": None if pd.isnull(leases.iloc[0, 2]) else int(leases.iloc[0, 2]),
+    }
+
+
+def is_work_queue_complete(connection: Connection, queue_name: str) -> bool:
+    status = queue_status(connection, queue_name)
+    return status["next_order"] >= status["total"] and status["outstanding_leases"] == 0
+
+
+def run_worker(connection: Connection, queue_name: str, process_batch: Callable,
+               batch_size: Union[int, BatchSizer], worker_id: Union[str, None] = None,
+               lease_seconds: int = LEASE_SECONDS, max_batches: Union[int, None] = None
+               ) -> int:
+    worker_id = worker_id or new_worker_id()
+    sizer = None if isinstance(batch_size, int) else batch_size
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        size = sizer.start_batch() if sizer else batch_size
+        lease = claim_batch(connection, queue_name, size, worker_id, lease_seconds)
+
+        if lease is None:
+            status = queue_status(connection, queue_name)
+            if status["outstanding_leases"] == 0:
+                break
+            # Everything left is leased to other workers; wait in case one of them dies.
+            time.sleep(min(max(status["seconds_to_next_expiry"] or 0, 1), 30))
+            continue
+
+        try:
+            with transaction(connection):
+                process_batch(connection, lease)
+                complete_batch(connection, queue_name, lease)
+        except LeaseLost as e:
+            print(e)
+            continue
+
+        batches += 1
+        print(f"{worker_id} processed [{lease.start_order}, {lease.end_order})")
+        if sizer:
+            sizer.finish_batch(lease.end_order - lease.start_order)
+
+    return batches
+
+
+def _run_worker_process(connection_info: dict, queue_name: str, process_batch: Callable,
+                        batch_size: Union[int, BatchSizer], lease_seconds: int
+                        ) -> int:
+    with ConnectionPool(**connection_info, size=1) as pool:
+        with pool.connection() as connection:
+            return run_worker(connection, queue_name, process_batch, batch_size,
+                              lease_seconds=lease_seconds
+                              )
+
+
+def _check_work_queue_exists(connection: Connection, queue_name: str) -> None:
+    tables = run_query(connection, "SHOW TABLES")
+    tables = tables[tables.columns[-1]].to_list()
+    if f"{queue_name}_cursor" in tables:
+        return
+    # Runs started before the work queue kept their position in a single-row {queue}_progress table,
+    # which can't be turned into leases safely since its results table may have a different schema.
+    if f"{queue_name}_progress" in tables:
+        raise RuntimeError(f"'{queue_name}' was started with the old {queue_name}_progress table, "
+                           f"which can't be resumed as a work queue. Re-run its init function to "
+                           f"start again.")
+    raise RuntimeError(f"Work queue '{queue_name}' does not exist. Run its init function first.")
+
+
+def run_workers(connection: Connection, queue_name: str, process_batch: Callable,
+                batch_size: Union[int, BatchSizer], workers: int = 4,
+                lease_seconds: int = LEASE_SECONDS
+                ) -> int:
+    _check_work_queue_exists(connection, queue_name)
+
+    # process_batch runs inside a transaction, so it must only write to tables that already exist:
+    # DDL would commit the transaction early. It must also be importable by a fresh interpreter: a
+    # module-level function or a partial of one.
+    if workers <= 1:
+        return run_worker(connection, queue_name, process_batch, batch_size,
+                          lease_seconds=lease_seconds
+                          )
+
+    connection_info = ConnectionPool.from_connection(connection).connection_info
+    # Spawned rather than forked: this can run on a scheduler thread while pooled connections and
+    # their locks are held, and a forked child would inherit them half-held.
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(_run_worker_process, connection_info, queue_name,
+                                   process_batch, batch_size, lease_seconds)
+                   for _ in range(workers)]
+        return sum(future.result() for future in futures)
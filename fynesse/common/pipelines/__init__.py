@@ -1 +1,10 @@
-from . import price_paid
+from fynesse._lazy import lazy_submodules
+
+__all__ = [
+        "add_census_data", "beach", "beach_intersects_msoa",
+        "create_gif_for_million_postcodes", "get_indicators", "part_1", "part_1_nssec_msoa",
+        "postcode", "price_paid", "process_postcode", "relate_postcode_price_paid",
+        "scheduler", "upload_work_type_relationships"
+]
+
+__getattr__, __dir__ = lazy_submodules(__name__, __all__)
@@ -4,33 +4,23 @@ from fynesse.common.db.db_operations import join_in_place
 
 
 def init_add_census_data(connection):
-    raw_hours_worked_by_oa = fetch_2021_census_data('TS059', 'oa')
-    hours_worked_by_oa = clean_hours_worked(raw_hours_worked_by_oa)
-
-    raw_commuter_distance_by_oa = fetch_2021_census_data('TS058', 'oa')
-    commuter_distance_by_oa = clean_commuter_distance(raw_commuter_distance_by_oa)
-
-    url = "https://github.com/FlamingoWinter/ads_practicals/raw/refs/heads/main/occupation_by_oa.zip"
-    raw_work_type_by_oa = fetch_2021_census_data('TS063', 'oa',
-                                                 custom_url=url
-                                                 )
-    work_type_by_oa = clean_work_type(raw_work_type_by_oa)
-
-    join_in_place(connection, "oa", hours_worked_by_oa, on=["Geography_Code"])
-    join_in_place(connection, "oa", commuter_distance_by_oa, on=["Geography_Code"])
-    join_in_place(connection, "oa", work_type_by_oa, on=["Geography_Code"])
+    (hours_worked_by_oa, commuter_distance_by_oa, work_type_by_oa,
+     work_type_by_msoa, hours_worked_by_msoa, commuter_distance_by_msoa) = fetch_clean_census_tables([
+            (HOURS_WORKED, 'oa'),
+            (COMMUTER_DISTANCE, 'oa'),
+            (WORK_TYPE, 'oa'),
+            (WORK_TYPE_DETAILED, 'msoa'),
+            (HOURS_WORKED, 'msoa'),
+            (COMMUTER_DISTANCE, 'msoa'),
+    ])
+
+    join_in_place(connection, "oa", [hours_worked_by_oa, commuter_distance_by_oa, work_type_by_oa],
+                  on=["Geography_Code"]
+                  )
 
     # -------------------------------------------------------------------------------------------------------------------
 
-    raw_work_type_by_msoa = fetch_2021_census_data('TS064', 'msoa')
-    work_type_by_msoa = clean_work_type_detailed(raw_work_type_by_msoa)
-
-    raw_hours_worked_by_msoa = fetch_2021_census_data('TS059', 'msoa')
-    hours_worked_by_msoa = clean_hours_worked(raw_hours_worked_by_msoa)
-
-    raw_commuter_distance_by_msoa = fetch_2021_census_data('TS058', 'msoa')
-    commuter_distance_by_msoa = clean_commuter_distance(raw_commuter_distance_by_msoa)
-
-    join_in_place(connection, "msoa", hours_worked_by_msoa, on=["Geography_Code"])
-    join_in_place(connection, "msoa", commuter_distance_by_msoa, on=["Geography_Code"])
-    join_in_place(connection, "msoa", work_type_by_msoa, on=["Geography_Code"])
+    join_in_place(connection, "msoa",
+                  [hours_worked_by_msoa, commuter_distance_by_msoa, work_type_by_msoa],
+                  on=["Geography_Code"]
+                  )
@@ -0,0 +1,142 @@
+import os
+import sys
+import time
+from typing import Union
+
+import pandas as pd
+
+MEMORY_FRACTION = 0.5
+
+
+def physical_memory_bytes() -> Union[int, None]:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_memory_limit(workers: int = 1) -> Union[int, None]:
+    memory = physical_memory_bytes()
+    return int(memory * MEMORY_FRACTION / max(workers, 1)) if memory else None
+
+
+def current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return peak_rss_bytes()
+
+
+def reset_peak_rss() -> None:
+    # Linux resets VmHWM to the current RSS when 5 is written to clear_refs; elsewhere the peak
+    # only ever grows, so per-batch growth is underestimated rather than wrong.
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_bytes() -> int:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class AdaptiveBatchSize:
+    def __init__(self, initial_size: int, target_seconds: float, min_size: int = 1,
+                 max_size: Union[int, None] = None,
+                 memory_limit_bytes: Union[int, None] = None, smoothing: float = 0.3,
+                 max_growth: float = 2.0, name: str = "batch", log_path: Union[str, None] = None
+                 ):
+        self.size = initial_size
+        self.target_seconds = target_seconds
+        self.min_size = min_size
+        self.max_size = max_size
+        self.memory_limit_bytes = memory_limit_bytes
+        self.smoothing = smoothing
+        self.max_growth = max_growth
+        self.name = name
+        self.log_path = log_path
+
+        self.rows_per_second = None
+        self.bytes_per_row = None
+        self.history = []
+
+        self._started_at = None
+        self._rss_before = None
+
+    def start_batch(self) -> int:
+        reset_peak_rss()
+        self._rss_before = current_rss_bytes()
+        self._started_at = time.perf_counter()
+        return self.size
+
+    def _smooth(self, previous: Union[float, None], value: float) -> float:
+        return value if previous is None else self.smoothing * value + (1 - self.smoothing) * previous
+
+    def finish_batch(self, rows: int) -> int:
+        seconds = time.perf_counter() - self._started_at
+        peak_rss = peak_rss_bytes()
+
+        if rows > 0 and seconds > 0:
+            self.rows_per_second = self._smooth(self.rows_per_second, rows / seconds)
+            self.bytes_per_row = self._smooth(self.bytes_per_row,
+                                              max(peak_rss - self._rss_before, 0) / rows
+                                              )
+
+        size = self.size
+        self.size = self._next_size()
+
+        record = {
+                "name"           : self.name,
+                "finished_at"    : time.time(),
+                "batch_size"     : size,
+                "rows"           : rows,
+                "seconds"        : seconds,
+                "rows_per_second": rows / seconds if seconds > 0 else None,
+                "peak_rss_bytes" : peak_rss,
+                "next_batch_size": self.size,
+        }
+        self.history.append(record)
+        self._log(record)
+        return self.size
+
+    def _next_size(self) -> int:
+        if self.rows_per_second is None:
+            return self.size
+
+        size = self.rows_per_second * self.target_seconds
+        # Limit each step so one unusually fast or slow batch doesn't swing the size wildly.
+        size = min(max(size, self.size / self.max_growth), self.size * self.max_growth)
+
+        if self.memory_limit_bytes and self.bytes_per_row:
+            headroom = self.memory_limit_bytes - self._rss_before
+            size = min(size, max(headroom, 0) / self.bytes_per_row)
+
+        size = max(int(size), self.min_size)
+        return min(size, self.max_size) if self.max_size else size
+
+    def _log(self, record: dict) -> None:
+        print(f"{self.name}: {record['rows']} rows in {record['seconds']:.1f}s "
+              f"({record['rows_per_second'] or 0:.1f} rows/s), "
+              f"peak rss {record['peak_rss_bytes'] / 2 ** 20:.0f} MiB, "
+              f"next batch {record['next_batch_size']}"
+              )
+
+        if self.log_path:
+            pd.DataFrame([record]).to_csv(self.log_path, mode="a", index=False,
+                                          header=not os.path.exists(self.log_path)
+                                          )
+
+    def history_df(self) -> pd.DataFrame:
+        return pd.DataFrame(self.history)
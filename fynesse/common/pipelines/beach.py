@@ -8,7 +8,7 @@ from shapely.wkt import loads
 from fynesse.access.fetch import fetch_coast, fetch_uk_beaches
 from fynesse.assess.query import database_df_to_gpd
 from fynesse.common.db.db import run_query, add_key, abort_deletion_if_table_exists
-from fynesse.common.db.db_operations import upload_to_database
+from fynesse.common.db.db_operations import convert_to_native_geometry, upload_to_database
 
 
 def remove_annoying_characters(name):
@@ -23,6 +23,9 @@ def init_beach_pipeline(connection):
     if abort_deletion_if_table_exists(connection, "beach_intersects_oa"):
         return
 
+    # oa may predate native geometry columns, in which case ST_AsWKB would return NULL.
+    convert_to_native_geometry(connection, "oa")
+
     coast = fetch_coast()
     uk_beaches = fetch_uk_beaches()
 
@@ -45,9 +48,8 @@ def init_beach_pipeline(connection):
 
     unique_beaches = coastal_beaches.drop_duplicates(subset="id")
 
-    oa_boundaries = run_query(connection, "SELECT id as oa_id, geometry FROM oa")
-    oa_buffered_boundaries = database_df_to_gpd(oa_boundaries)
-    oa_buffered_boundaries = oa_buffered_boundaries.to_crs("EPSG:27700")
+    oa_boundaries = run_query(connection, "SELECT id as oa_id, ST_AsWKB(geometry) AS geometry FROM oa")
+    oa_buffered_boundaries = database_df_to_gpd(oa_boundaries, target_crs="EPSG:27700")
     oa_buffered_boundaries['geometry'] = oa_buffered_boundaries.geometry.buffer(50)
     oa_buffered_boundaries = oa_buffered_boundaries.to_crs("EPSG:4326")
 
@@ -88,7 +90,7 @@ def init_beach_pipeline(connection):
 
     beach_to_oa = beaches_with_oa[["lat", "lng", "oa_id"]]
 
-    beach_to_lat_lng = run_query(connection, "SELECT * FROM beach")
+    beach_to_lat_lng = run_query(connection, "SELECT id, lat, lng FROM beach")
 
     beach_to_lat_lng = beach_to_lat_lng.merge(beach_to_oa, on=["lat", "lng"], how="inner")[
         ["id", "oa_id"]]
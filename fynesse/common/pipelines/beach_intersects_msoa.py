@@ -1,17 +1,19 @@
 import geopandas as gpd
 
-from fynesse.access.upload import upload_to_database
+from fynesse.access.upload import convert_to_native_geometry, upload_to_database
 from fynesse.assess.query import database_df_to_gpd
 from fynesse.common.db.db import run_query
-from fynesse.common.db.db_index_management import add_index
+from fynesse.common.db.db_index_management import apply_index_plan
 
 
 def init_beach_intersects_msoa(connection):
     run_query(connection, "DROP TABLE IF EXISTS beach_intersects_msoa")
 
-    msoa_boundaries = run_query(connection, "SELECT id as msoa_id, geometry FROM msoa")
-    msoa_buffered_boundaries = database_df_to_gpd(msoa_boundaries)
-    msoa_buffered_boundaries = msoa_buffered_boundaries.to_crs("EPSG:27700")
+    # msoa may predate native geometry columns, in which case ST_AsWKB would return NULL.
+    convert_to_native_geometry(connection, "msoa")
+
+    msoa_boundaries = run_query(connection, "SELECT id as msoa_id, ST_AsWKB(geometry) AS geometry FROM msoa")
+    msoa_buffered_boundaries = database_df_to_gpd(msoa_boundaries, target_crs="EPSG:27700")
     msoa_buffered_boundaries['geometry'] = msoa_buffered_boundaries.geometry.buffer(50)
     msoa_buffered_boundaries = msoa_buffered_boundaries.to_crs("EPSG:4326")
 
@@ -21,7 +23,7 @@ def init_beach_intersects_msoa(connection):
             inplace=True
     )
 
-    unique_beaches = run_query(connection, "SELECT id as beach_id, geometry FROM beach")
+    unique_beaches = run_query(connection, "SELECT id as beach_id, ST_AsWKB(geometry) AS geometry FROM beach")
     unique_beaches = database_df_to_gpd(unique_beaches, crs="EPSG:4326")
 
     beaches_with_msoa = gpd.sjoin(unique_beaches, msoa_buffered_boundaries, how="inner",
@@ -33,7 +35,9 @@ def init_beach_intersects_msoa(connection):
     upload_to_database(connection, "beach_intersects_msoa",
                        beaches_with_msoa[["beach_id", "msoa_id"]]
                        )
-    add_index(connection, "beach_intersects_oa", "oa_id")
-    add_index(connection, "beach_intersects_oa", "beach_id")
-    add_index(connection, "beach_intersects_msoa", "msoa_id")
-    add_index(connection, "beach_intersects_msoa", "beach_id")
+
+    apply_index_plan(connection, {
+            "beach_intersects_oa"  : ["oa_id", "beach_id"],
+            "beach_intersects_msoa": ["msoa_id", "beach_id"]
+    }, parallel=True
+                     )
@@ -1,10 +1,38 @@
-from random import sample
+from functools import partial
 
 import osmnx as ox
 import pandas as pd
 
-from fynesse.common.db.db import run_query, abort_deletion_if_table_exists
-from fynesse.common.db.db_operations import upload_to_database, append_to_database
+from fynesse.common.db.db import run_query, table_columns
+from fynesse.common.db.db_operations import SPATIAL_COLUMN_TYPES, append_to_database
+from fynesse.common.db.db_work_queue import (create_work_queue, fetch_batch, run_workers,
+                                             drop_work_queue)
+from fynesse.common.pipelines.batch_sizing import AdaptiveBatchSize, default_memory_limit
+
+INDICATOR_COLUMNS = {
+        "houses"              : {"building": "residential"},
+
+        "dorms"               : {"building": "dormitory"},
+        "university_buildings": {"building": "university"},
+        "academic_buildings"  : {"building": "academic"},
+        "office_buildings"    : {"building": "office"},
+
+        "playgrounds"         : {"leisure": "playground"},
+        "benches"             : {"amenity": "bench"},
+        "retirement_homes"    : {"residential": "retirement_home"},
+        "fast_foods"          : {"amenity": "fast_food"},
+        "schools"             : {"amenity": "school"},
+        "clubs"               : {"amenity": "nightclub"},
+        "pubs"                : {"amenity": "pub"},
+        "parks"               : {"leisure": "park"},
+
+        "cafes"               : {"amenity": "cafe"},
+        "theatres"            : {"amenity": "theatre"},
+        "cinemas"             : {"amenity": "cinema"},
+        "bookshops"           : {"shop": "books"},
+        "fashion_shops"       : {"shop": "clothes"},
+        "unisex_toilets"      : {"toilets:unisex": "yes"}
+}
 
 
 def amend_df_with_indicators(df,
@@ -25,31 +53,6 @@ def amend_df_with_indicators(df,
                 "toilets:unisex": ["yes"]
         }
 
-        columns = {
-                "houses"              : {"building": "residential"},
-
-                "dorms"               : {"building": "dormitory"},
-                "university_buildings": {"building": "university"},
-                "academic_buildings"  : {"building": "academic"},
-                "office_buildings"    : {"building": "office"},
-
-                "playgrounds"         : {"leisure": "playground"},
-                "benches"             : {"amenity": "bench"},
-                "retirement_homes"    : {"residential": "retirement_home"},
-                "fast_foods"          : {"amenity": "fast_food"},
-                "schools"             : {"amenity": "school"},
-                "clubs"               : {"amenity": "nightclub"},
-                "pubs"                : {"amenity": "pub"},
-                "parks"               : {"leisure": "park"},
-
-                "cafes"               : {"amenity": "cafe"},
-                "theatres"            : {"amenity": "theatre"},
-                "cinemas"             : {"amenity": "cinema"},
-                "bookshops"           : {"shop": "books"},
-                "fashion_shops"       : {"shop": "clothes"},
-                "unisex_toilets"      : {"toilets:unisex": "yes"}
-        }
-
         to_amend = {}
 
         try:
@@ -60,7 +63,7 @@ def amend_df_with_indicators(df,
                 polygon = row[geometry_column_name]
                 pois = ox.features_from_polygon(polygon, tags)
 
-            for column_name, tags in columns.items():
+            for column_name, tags in INDICATOR_COLUMNS.items():
                 filtered = pois
                 for tag_key, tag_value in tags.items():
                     if tag_key in filtered.columns:
@@ -72,7 +75,7 @@ def amend_df_with_indicators(df,
 
         except:
             # InsufficientResponseError
-            for column_name in columns:
+            for column_name in INDICATOR_COLUMNS:
                 to_amend[column_name] = 0
 
         return pd.Series(to_amend)
@@ -84,77 +87,64 @@ def amend_df_with_indicators(df,
     return df
 
 
+def _non_spatial_columns(connection, table_name):
+    columns = table_columns(connection, table_name)
+    spatial = columns["Type"].str.lower().str.startswith(SPATIAL_COLUMN_TYPES)
+    return columns.loc[~spatial, "Field"].to_list()
+
+
 def init_get_indicators(connection, old_table, new_table):
-    progress_table_name = f"{new_table}_progress"
-    index_table_name = f"{new_table}_indexes"
-
-    indexes = run_query(connection, f"SELECT id FROM {old_table}")
-    indexes['random_order'] = sample(range(len(indexes)), len(indexes))
-    upload_to_database(connection, index_table_name, indexes)
-
-    if not abort_deletion_if_table_exists(connection, progress_table_name):
-        create_query = f"""
-                                CREATE TABLE {progress_table_name} (
-                                id INTEGER PRIMARY KEY AUTO_INCREMENT, last_processed_index INTEGER NOT NULL
-                            );
-                            """
-        run_query(connection, create_query)
-        run_query(connection,
-                  f"INSERT INTO {progress_table_name} (last_processed_index) VALUES (0)"
-                  )
-        run_query(connection, f"DROP TABLE IF EXISTS {new_table}")
+    if not create_work_queue(connection, new_table, old_table):
+        return
+
+    run_query(connection, f"DROP TABLE IF EXISTS {new_table}")
+
+    # The results table is created before any batch runs, so batches only insert inside their
+    # transactions. Geometry stays in old_table and can be joined back on old_id.
+    columns = ", ".join(f"t.`{col}`" for col in _non_spatial_columns(connection, old_table)
+                        if col != "id")
+    run_query(connection, f"""
+        CREATE TABLE {new_table} AS
+        SELECT o.random_order, t.id AS old_id, {columns}
+        FROM {new_table}_indexes o
+        JOIN {old_table} t ON o.id = t.id
+        LIMIT 0
+    """
+              )
+    run_query(connection, f"ALTER TABLE {new_table} " + ", ".join(
+            f"ADD COLUMN `{col}` INT NOT NULL DEFAULT 0" for col in INDICATOR_COLUMNS
+    ))
 
 
 distance_km = 2
 batch_size = 20
+target_batch_seconds = 120
 
 
-def resume_get_indicators(connection, old_table, new_table, distance_km):
-    progress_table_name = f"{new_table}_progress"
-    index_table_name = f"{new_table}_indexes"
-
-    while True:
-        last_processed_index = run_query(connection, f"SELECT * FROM {progress_table_name}")[
-            "last_processed_index"]
+def process_indicators_batch(connection, lease, old_table, new_table, distance_km=distance_km):
+    batch = fetch_batch(connection, new_table, old_table, lease)
 
-        if len(last_processed_index) == 1:
-            last_processed_index = last_processed_index[0]
-        else:
-            last_processed_index = 0
+    indicators = amend_df_with_indicators(batch, radius_around_point=True,
+                                          distance_km=distance_km
+                                          )
+    indicators.rename(columns={"id": "old_id"}, inplace=True)
 
-        batch_query = f"""
-                    SELECT random_order, t.*
-                    FROM {new_table}_indexes o
-                    JOIN {old_table} t ON o.id = t.id
-                    WHERE o.random_order > {last_processed_index}
-                    ORDER BY o.random_order
-                    LIMIT {batch_size}
-                """
-        batch = run_query(connection, batch_query)
+    append_to_database(connection, new_table,
+                       indicators[_non_spatial_columns(connection, new_table)]
+                       )
 
-        if len(batch) == 0:
-            print(f"done with last processed index = {last_processed_index}")
-            break
 
-        indicators = amend_df_with_indicators(batch, radius_around_point=True,
-                                              distance_km=distance_km
-                                              )
-        indicators.rename(columns={"id": "old_id"}, inplace=True)
-
-        append_to_database(connection, new_table, indicators)
-
-        new_progress = batch['random_order'].max()
-        run_query(connection,
-                  f"UPDATE {new_table}_progress SET last_processed_index = {new_progress}"
-                  )
-
-        print(f"Processed up to random_order: {new_progress}...")
+def resume_get_indicators(connection, old_table, new_table, distance_km=distance_km, workers=1):
+    # Each batch is dominated by Overpass requests rather than the database, so extra workers
+    # scale almost linearly until the API starts rate limiting.
+    process_batch = partial(process_indicators_batch, old_table=old_table, new_table=new_table,
+                            distance_km=distance_km
+                            )
+    sizer = AdaptiveBatchSize(batch_size, target_batch_seconds,
+                              memory_limit_bytes=default_memory_limit(workers), name=new_table
+                              )
+    run_workers(connection, new_table, process_batch, sizer, workers)
 
     print("Pipeline completed. Deleting metadata...")
-    run_query(connection,
-              f"DROP table IF EXISTS {progress_table_name}"
-              )
-    run_query(connection,
-              f"DROP table IF EXISTS {index_table_name}"
-              )
+    drop_work_queue(connection, new_table)
     print("Deleted Metadata")
@@ -1,19 +1,19 @@
-from fynesse.access import *
+from fynesse.access import clean, fetch, join, optimise, upload
 
 
 def init_part_1(connection):
     print("Fetching Data...")
 
-    raw_nssec_oa = fetch.fetch_2021_census_data(code='TS062', level='oa')
-    raw_sexual_orientation_msoa = fetch.fetch_2021_census_data(code='TS077', level='msoa')
+    nssec_oa, sexual_orientation_msoa = fetch.fetch_clean_census_tables([
+            (clean.NSSEC, 'oa'),
+            (clean.SEXUAL_ORIENTATION, 'msoa')
+    ])
 
     raw_geography_oa = fetch.fetch_2021_census_geography(level='oa')
     raw_geography_msoa = fetch.fetch_2021_census_geography(level='msoa')
 
     print("Cleaning Data...")
 
-    nssec_oa = clean.clean_nssec(raw_nssec_oa)
-    sexual_orientation_msoa = clean.clean_sexual_orientation(raw_sexual_orientation_msoa)
     geography_oa = clean.clean_geography_oa(raw_geography_oa)
     geography_msoa = clean.clean_geography_msoa(raw_geography_msoa)
 
@@ -31,12 +31,13 @@ def init_part_1(connection):
 
     print("Adding indexes to tables...")
 
-    for table_name in df_by_table_name:
-        optimise.add_index(connection, table_name, "Geography")
-        optimise.add_index(connection, table_name, "Geography_Code")
-
-    for geography_table_name in ["geography_oa", "geography_msoa"]:
-        optimise.add_multiple_indexes(connection, geography_table_name, ["lat", "lng"])
+    optimise.apply_index_plan(connection, {
+            "sexual_orientation_msoa": ["Geography", "Geography_Code"],
+            "nssec_oa"               : ["Geography", "Geography_Code"],
+            "geography_oa"           : ["Geography", "Geography_Code", ["lat", "lng"]],
+            "geography_msoa"         : ["Geography", "Geography_Code", ["lat", "lng"]]
+    }, parallel=True
+                              )
 
     print("Creating in-database joined tables...")
 
@@ -49,10 +50,11 @@ def init_part_1(connection):
 
     print("Adding indexes to in-database joined tables...")
 
-    for table_name in ["nssec_oa_geog", "sexual_orientation_msoa_geog"]:
-        optimise.add_index(connection, table_name, "Geography")
-        optimise.add_index(connection, table_name, "Geography_Code")
-        optimise.add_multiple_indexes(connection, table_name, ["lat", "lng"])
+    optimise.apply_index_plan(connection, {
+            "nssec_oa_geog"               : ["Geography", "Geography_Code", ["lat", "lng"]],
+            "sexual_orientation_msoa_geog": ["Geography", "Geography_Code", ["lat", "lng"]]
+    }, parallel=True
+                              )
 
     optimise.add_key(connection, "sexual_orientation_msoa_geog")
     optimise.add_key(connection, "nssec_oa_geog")
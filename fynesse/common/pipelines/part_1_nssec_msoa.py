@@ -1,23 +1,21 @@
-from fynesse.access import *
+from fynesse.access import clean, fetch, join, optimise, upload
 
 
 def init_part_1_nssec_msoa(connection):
-    raw_nssec_msoa = fetch.fetch_2021_census_data(code='TS062', level='msoa')
-
-    nssec_msoa = clean.clean_nssec(raw_nssec_msoa)
+    nssec_msoa = fetch.fetch_clean_census_data(clean.NSSEC, level='msoa')
 
     upload.upload_to_database(connection, "nssec_msoa", nssec_msoa)
 
-    optimise.add_index(connection, "nssec_msoa", "Geography")
-    optimise.add_index(connection, "nssec_msoa", "Geography_Code")
+    optimise.apply_index_plan(connection, {"nssec_msoa": ["Geography", "Geography_Code"]})
 
     join.join_tables(connection, "sexual_orientation_msoa_geog", "nssec_msoa", on="Geography",
                      joined_table_name="sexual_orientation_nssec_msoa_geog"
                      )
 
-    optimise.add_index(connection, "sexual_orientation_nssec_msoa_geog", "Geography")
-    optimise.add_index(connection, "sexual_orientation_nssec_msoa_geog", "Geography_Code")
-    optimise.add_multiple_indexes(connection, "sexual_orientation_nssec_msoa_geog", ["lat", "lng"])
+    optimise.apply_index_plan(connection, {
+            "sexual_orientation_nssec_msoa_geog": ["Geography", "Geography_Code", ["lat", "lng"]]
+    }
+                              )
 
     optimise.add_key(connection, "sexual_orientation_nssec_msoa_geog")
 
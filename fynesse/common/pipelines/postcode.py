@@ -1,9 +1,8 @@
-import io
-import zipfile
-
-import requests
+import os
 
 from fynesse.access import optimise
+from fynesse.access.fetch import DATA_DIRECTORY, POSTCODE_URL
+from fynesse.access.http_cache import cached_archive
 from fynesse.common.db.db import run_query
 
 
@@ -30,17 +29,12 @@ def init_postcode(connection):
               ) DEFAULT CHARSET=utf8 COLLATE=utf8_bin;"""
               )
 
-    url = "https://www.getthedata.com/downloads/open_postcode_geo.csv.zip"
-    response = requests.get(url)
-    if response.status_code == 200:
-        with zipfile.ZipFile(io.BytesIO(response.content)) as z:
-            with z.open("open_postcode_geo.csv") as extracted_file:
-                with open("postcodes.csv", "wb") as outfile:
-                    outfile.write(extracted_file.read())
+    extract_dir = cached_archive(POSTCODE_URL, os.path.join(DATA_DIRECTORY, "open_postcode_geo"))
+    postcodes_path = os.path.join(extract_dir, "open_postcode_geo.csv")
 
-        run_query(connection, """
-        LOAD DATA LOCAL INFILE "./postcodes.csv" INTO TABLE `postcode` FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED by '"' LINES STARTING BY '' TERMINATED BY "\n";
-        """
-                  )
+    run_query(connection, f"""
+    LOAD DATA LOCAL INFILE "{postcodes_path}" INTO TABLE `postcode` FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED by '"' LINES STARTING BY '' TERMINATED BY "\n";
+    """
+              )
 
     optimise.add_key(connection, "postcode")
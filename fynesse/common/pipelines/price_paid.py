@@ -1,27 +1,42 @@
-import os
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
-
-from fynesse.common.db.db import abort_deletion_if_table_exists, run_query
+from fynesse.access.http_cache import DEFAULT_MAX_AGE_SECONDS, cached_download
+from fynesse.common.db.db import abort_deletion_if_table_exists, run_query, transaction
+from fynesse.common.db.db_index_management import add_index, index_exists
 
 houses_table_name = "price_paid"
 progress_table_name = f"upload_houses_progress"
 
+PRICE_PAID_BASE_URL = "http://prod.publicdata.landregistry.gov.uk.s3-website-eu-west-1.amazonaws.com"
+LAST_YEAR = 2024
+MONTHLY_UPDATE_FILE = "pp-monthly-update-new-version.csv"
 
-def download_price_paid_data(year, part):
-    file_path = f"./pp-{year}-part{part}.csv"
+TRANSACTION_KEY = "transaction_unique_identifier"
+PRICE_PAID_COLUMNS = ["transaction_unique_identifier", "price", "date_of_transfer", "postcode",
+                      "property_type", "new_build_flag", "tenure_type",
+                      "primary_addressable_object_name", "secondary_addressable_object_name",
+                      "street", "locality", "town_city", "district", "county",
+                      "ppd_category_type", "record_status"]
 
-    if os.path.exists(file_path):
-        print(f"file  already exists. skipping")
-        return
 
-    base_url = f"http://prod.publicdata.landregistry.gov.uk.s3-website-eu-west-1.amazonaws.com/pp-{str(year)}-part{str(part)}.csv"
-    with requests.get(base_url, stream=True) as response:
-        response.raise_for_status()
-        with open(file_path, "wb") as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    file.write(chunk)
+def price_paid_url(year, part, base_url=PRICE_PAID_BASE_URL):
+    return f"{base_url}/pp-{year}-part{part}.csv"
+
+
+def download_price_paid_data(year, part, base_url=PRICE_PAID_BASE_URL):
+    # Published years don't change, so they are trusted once cached rather than revalidated.
+    max_age = None if year < LAST_YEAR else DEFAULT_MAX_AGE_SECONDS
+    return cached_download(price_paid_url(year, part, base_url), max_age=max_age)
+
+
+def parts_to_process(last_processed_year, last_processed_part, last_year=LAST_YEAR):
+    parts = []
+    year, part = last_processed_year, last_processed_part
+    while True:
+        year, part = (year + 1, 1) if part == 2 else (year, part + 1)
+        if year > last_year:
+            return parts
+        parts.append((year, part))
 
 
 def init_price_paid(connection):
@@ -37,7 +52,7 @@ def init_price_paid(connection):
                   )
         run_query(connection, f"DROP TABLE IF EXISTS {houses_table_name}")
         run_query(connection, f"""CREATE TABLE IF NOT EXISTS `{houses_table_name}` (
-                      `transaction_unique_identifier` tinytext COLLATE utf8_bin NOT NULL,
+                      `transaction_unique_identifier` varchar(38) COLLATE utf8_bin NOT NULL,
                       `price` int(10) unsigned NOT NULL,
                       `date_of_transfer` date NOT NULL,
                       `postcode` varchar(8) COLLATE utf8_bin NOT NULL,
@@ -53,47 +68,114 @@ def init_price_paid(connection):
                       `county` tinytext COLLATE utf8_bin NOT NULL,
                       `ppd_category_type` varchar(2) COLLATE utf8_bin NOT NULL,
                       `record_status` varchar(2) COLLATE utf8_bin NOT NULL,
-                      `db_id` bigint(20) unsigned NOT NULL
+                      `db_id` bigint(20) unsigned NOT NULL,
+                      UNIQUE KEY `transaction_unique_identifier` (`transaction_unique_identifier`)
                     ) DEFAULT CHARSET=utf8 COLLATE=utf8_bin AUTO_INCREMENT=1 ;
                     """
                   )
 
 
-def resume_price_paid(connection):
-    while True:
-        last_processed = run_query(connection, f"SELECT * FROM {progress_table_name}")
-
-        last_processed_year = last_processed.iloc[[0]]["last_processed_year"][0]
-        last_processed_part = last_processed.iloc[[0]]["last_processed_part"][0]
+def load_price_paid_part(connection, file_path, table_name=houses_table_name, replace=False):
+    run_query(connection, f"""
+            LOAD DATA LOCAL INFILE "{file_path}" {"REPLACE" if replace else ""}
+            INTO TABLE `{table_name}` FIELDS TERMINATED BY ',' 
+            OPTIONALLY ENCLOSED by '"' LINES STARTING BY '' 
+            TERMINATED BY '\n';
+    """
+              )
 
-        if last_processed_part == 2:
-            part_to_process = 1
-            year_to_process = last_processed_year + 1
-        else:
-            part_to_process = last_processed_part + 1
-            year_to_process = last_processed_year
 
-        if year_to_process > 2024:
-            print("Finished processing up to 2024")
-            break
+def resume_price_paid(connection, base_url=PRICE_PAID_BASE_URL, download_workers=4):
+    last_processed = run_query(connection, f"SELECT * FROM {progress_table_name}")
 
-        print(f"Processing part {part_to_process} of year {year_to_process}")
+    last_processed_year = last_processed.iloc[[0]]["last_processed_year"][0]
+    last_processed_part = last_processed.iloc[[0]]["last_processed_part"][0]
 
-        download_price_paid_data(year_to_process, part_to_process)
+    parts = parts_to_process(last_processed_year, last_processed_part)
 
-        run_query(connection, f"""
-                LOAD DATA LOCAL INFILE "./pp-{year_to_process}-part{part_to_process}.csv" 
-                INTO TABLE `{houses_table_name}` FIELDS TERMINATED BY ',' 
-                OPTIONALLY ENCLOSED by '"' LINES STARTING BY '' 
-                TERMINATED BY '\n';
-        """
-                  )
+    # Downloads run ahead in the pool while parts are loaded strictly in order on this thread, so
+    # the checkpoint only ever advances past parts that are fully loaded.
+    with ThreadPoolExecutor(max_workers=download_workers) as executor:
+        downloads = [executor.submit(download_price_paid_data, year, part, base_url)
+                     for year, part in parts]
+        try:
+            for (year, part), download in zip(parts, downloads):
+                file_path = download.result()
 
-        run_query(connection,
-                  f"UPDATE {progress_table_name} SET last_processed_year = {year_to_process}, last_processed_part = {part_to_process}"
-                  )
+                print(f"Processing part {part} of year {year}")
+                with transaction(connection):
+                    load_price_paid_part(connection, file_path)
+                    run_query(connection,
+                              f"UPDATE {progress_table_name} SET last_processed_year = {year}, last_processed_part = {part}"
+                              )
 
-        print(f"Processed part {part_to_process} of year {year_to_process}")
+                print(f"Processed part {part} of year {year}")
+        except BaseException:
+            for download in downloads:
+                download.cancel()
+            raise
 
+    print(f"Finished processing up to {LAST_YEAR}")
     print("Dropping metadata...")
     run_query(connection, f"DROP TABLE IF EXISTS {progress_table_name};")
+
+
+def add_transaction_key(connection):
+    # Tables loaded before the key existed stored identifiers as tinytext, which can't be keyed.
+    if index_exists(connection, houses_table_name, TRANSACTION_KEY):
+        return
+
+    print(f"Adding unique key on {TRANSACTION_KEY}...")
+    run_query(connection, f"""
+            ALTER TABLE `{houses_table_name}`
+            MODIFY `{TRANSACTION_KEY}` varchar(38) COLLATE utf8_bin NOT NULL,
+            ADD UNIQUE KEY `{TRANSACTION_KEY}` (`{TRANSACTION_KEY}`)
+    """
+              )
+
+
+def apply_price_paid_update(connection, file_path, staging_table_name=f"{houses_table_name}_update"):
+    add_transaction_key(connection)
+    add_index(connection, "postcode", "postcode")
+
+    columns = ", ".join(PRICE_PAID_COLUMNS)
+    staged_columns = ", ".join(f"s.{column}" for column in PRICE_PAID_COLUMNS)
+    updates = ", ".join(f"{column} = VALUES({column})"
+                        for column in PRICE_PAID_COLUMNS + ["db_id"] if column != TRANSACTION_KEY)
+
+    run_query(connection, f"DROP TEMPORARY TABLE IF EXISTS {staging_table_name}")
+    run_query(connection, f"CREATE TEMPORARY TABLE {staging_table_name} LIKE {houses_table_name}")
+    # A record changed twice in one file appears twice; REPLACE keeps the later line.
+    load_price_paid_part(connection, file_path, staging_table_name, replace=True)
+
+    counts = run_query(connection,
+                       f"SELECT record_status, COUNT(*) AS records FROM {staging_table_name} GROUP BY record_status"
+                       )
+    print("Staged " + ", ".join(f"{status}: {records}" for status, records in counts.itertuples(index=False)))
+
+    with transaction(connection):
+        deleted = run_query(connection, f"""
+                DELETE p FROM {houses_table_name} p
+                JOIN {staging_table_name} s USING ({TRANSACTION_KEY})
+                WHERE s.record_status = 'D'
+        """
+                            )
+        # Adds and changes are upserted with their db_id looked up here, so only the affected rows
+        # are relinked and relate_postcode_price_paid doesn't need rerunning.
+        upserted = run_query(connection, f"""
+                INSERT INTO {houses_table_name} ({columns}, db_id)
+                SELECT {staged_columns}, COALESCE(pc.id, 0)
+                FROM {staging_table_name} s
+                LEFT JOIN postcode pc ON s.postcode = pc.postcode
+                WHERE s.record_status IN ('A', 'C')
+                ON DUPLICATE KEY UPDATE {updates}
+        """
+                             )
+
+    run_query(connection, f"DROP TEMPORARY TABLE IF EXISTS {staging_table_name}")
+    print(f"Applied price paid update: {deleted} rows deleted, {upserted} rows affected by adds and changes")
+
+
+def update_price_paid(connection, base_url=PRICE_PAID_BASE_URL, file_name=MONTHLY_UPDATE_FILE):
+    # The monthly file is republished under the same name, so it is always revalidated.
+    apply_price_paid_update(connection, cached_download(f"{base_url}/{file_name}", max_age=0))
@@ -1,109 +1,89 @@
-from random import sample
-
 import geopandas as gpd
 
+from fynesse.assess.nearest import nearest_features
 from fynesse.assess.query import database_df_to_gpd
-from fynesse.common.db.db import run_query, abort_deletion_if_table_exists
-from fynesse.common.db.db_operations import upload_to_database, append_to_database
+from fynesse.common.db.db import run_query
+from fynesse.common.db.db_operations import append_to_database
+from fynesse.common.db.db_work_queue import (create_work_queue, fetch_batch, run_workers,
+                                             drop_work_queue)
+from fynesse.common.pipelines.batch_sizing import AdaptiveBatchSize, default_memory_limit
 
-progress_table_name = f"process_postcodes_progress"
-index_table_name = f"process_postcodes_indexes"
+queue_name = "process_postcodes"
 
 
 def init_process_postcodes(connection):
-    indexes = run_query(connection, f"SELECT id FROM postcode")
-    indexes['random_order'] = sample(range(len(indexes)), len(indexes))
-    upload_to_database(connection, index_table_name, indexes)
-
-    if not abort_deletion_if_table_exists(connection, progress_table_name):
-        create_query = f"""
-                                CREATE TABLE {progress_table_name} (
-                                id INTEGER PRIMARY KEY AUTO_INCREMENT, last_processed_index INTEGER NOT NULL
-                            );
-                            """
-        run_query(connection, create_query)
-        run_query(connection,
-                  f"INSERT INTO {progress_table_name} (last_processed_index) VALUES (0)"
-                  )
-
+    if create_work_queue(connection, queue_name, "postcode"):
         run_query(connection, f"DROP TABLE IF EXISTS postcode_near_beach")
+        # Created up front so that batches only ever insert; DDL inside a batch's transaction
+        # would commit it early.
+        run_query(connection, """
+            CREATE TABLE postcode_near_beach (
+                postcode_id BIGINT NOT NULL,
+                beach_id BIGINT NOT NULL,
+                distance_to_beach DOUBLE NOT NULL
+            )
+        """
+                  )
 
 
 distance_km = 1
 batch_size = 10000
+target_batch_seconds = 30
 
+# Beaches by connection id, loaded once per worker process rather than once per batch.
+_beaches = {}
 
-def resume_process_postcodes(connection):
-    beaches = run_query(connection, f"SELECT * FROM beach")
+
+def load_beaches(connection):
+    if id(connection) in _beaches:
+        return _beaches[id(connection)]
+
+    beaches = run_query(connection, """
+        SELECT id, name, surface, lat, lng, ST_AsWKB(geometry) AS geometry FROM beach
+    """
+                        )
     beaches.rename(columns={'id': 'beach_id'}, inplace=True)
 
-    beaches = database_df_to_gpd(beaches, crs="EPSG:4326")
-    beaches = beaches.to_crs("EPSG:27700")
-
-    beaches["geobuffer"] = beaches.geometry.buffer(distance_km * 1000)
-
-    def postcodes_to_nearest_beach(postcodes):
-        postcodes_near_beach = gpd.sjoin(
-                postcodes, beaches.set_geometry("geobuffer"), how="inner",
-                predicate="intersects"
-        )
-
-        postcodes_near_beach["distance_to_beach"] = postcodes_near_beach.apply(
-                lambda row: row.geometry.distance(beaches.loc[row.index_right, "geometry"]), axis=1
-        )
-
-        nearest_beaches = (
-                postcodes_near_beach.sort_values(by="distance_to_beach")  # Sort by distance
-                .drop_duplicates(subset=postcodes.index.name)
-        )
-        return nearest_beaches[["postcode_id", "beach_id", "distance_to_beach"]]
-
-    while True:
-        last_processed_index = run_query(connection, f"SELECT * FROM {progress_table_name}")[
-            "last_processed_index"]
-
-        if len(last_processed_index) == 1:
-            last_processed_index = last_processed_index[0]
-        else:
-            last_processed_index = 0
-
-        batch_query = f"""
-                    SELECT random_order, p.*
-                    FROM {index_table_name} o
-                    JOIN postcode p ON o.id = p.id
-                    WHERE o.random_order > {last_processed_index}
-                    ORDER BY o.random_order
-                    LIMIT {batch_size}
-                """
-        postcodes = run_query(connection, batch_query)
-        postcodes = gpd.GeoDataFrame(
-                postcodes,
-                geometry=gpd.points_from_xy(postcodes["longitude"], postcodes["latitude"]),
-                crs="EPSG:4326"
-        )
-        postcodes = postcodes.to_crs("EPSG:27700")
-
-        if len(postcodes) == 0:
-            print(f"done with last processed index = {last_processed_index}")
-            break
-
-        postcodes = postcodes.rename(columns={"id": "postcode_id"})
-        postcode_beach_distance = postcodes_to_nearest_beach(postcodes)
-
-        append_to_database(connection, "postcode_near_beach", postcode_beach_distance)
-
-        new_progress = postcodes['random_order'].max()
-        run_query(connection,
-                  f"UPDATE {progress_table_name} SET last_processed_index = {new_progress}"
-                  )
+    beaches = database_df_to_gpd(beaches, crs="EPSG:4326", target_crs="EPSG:27700")
+
+    _beaches[id(connection)] = beaches
+    return beaches
+
+
+def postcodes_to_nearest_beach(postcodes, beaches):
+    nearest_beaches = nearest_features(postcodes, beaches, max_distance=distance_km * 1000,
+                                       feature_columns=["beach_id"],
+                                       distance_column="distance_to_beach"
+                                       )
+    return postcodes[["postcode_id"]].join(nearest_beaches, how="inner")
+
+
+def process_postcode_batch(connection, lease):
+    postcodes = fetch_batch(connection, queue_name, "postcode", lease, columnar=True)
+    postcodes = gpd.GeoDataFrame(
+            postcodes,
+            geometry=gpd.points_from_xy(postcodes["longitude"], postcodes["latitude"]),
+            crs="EPSG:4326"
+    )
+    postcodes = postcodes.to_crs("EPSG:27700")
+
+    postcodes = postcodes.rename(columns={"id": "postcode_id"})
+    postcode_beach_distance = postcodes_to_nearest_beach(postcodes, load_beaches(connection))
+
+    append_to_database(connection, "postcode_near_beach", postcode_beach_distance)
+
 
-        print(f"Processed up to random_order: {new_progress}...")
+def resume_process_postcodes(connection, workers=1):
+    sizer = AdaptiveBatchSize(batch_size, target_batch_seconds, min_size=100,
+                              memory_limit_bytes=default_memory_limit(workers),
+                              name=queue_name
+                              )
+    # Cleared even after a failure, so the next run in this process reloads the beaches.
+    try:
+        run_workers(connection, queue_name, process_postcode_batch, sizer, workers)
+    finally:
+        _beaches.clear()
 
     print("Pipeline completed. Deleting metadata...")
-    run_query(connection,
-              f"DROP table IF EXISTS {progress_table_name}"
-              )
-    run_query(connection,
-              f"DROP table IF EXISTS {index_table_name}"
-              )
+    drop_work_queue(connection, queue_name)
     print("Deleted Metadata")
@@ -0,0 +1,219 @@
+import importlib
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, NamedTuple, Optional, Tuple, Union
+
+import pandas as pd
+
+from fynesse.common.db.db import answer_prompts, run_query
+from fynesse.common.db.db_profile import profile_stage
+from fynesse.common.db.db_setup import (ConnectionPool, create_metadata_table_if_not_exists,
+                                        pipeline_metadata, update_metadata_on_start_pipeline,
+                                        update_metadata_on_end_pipeline)
+
+
+class PipelineSpec(NamedTuple):
+    name: str
+    # Either a callable or a "module:function" entry point, imported only when the stage runs.
+    init: Union[Callable, str]
+    resume: Union[Callable, str, None] = None
+    inputs: Tuple[str, ...] = ()
+    outputs: Tuple[str, ...] = ()
+    arguments: Optional[dict] = None
+
+
+def resolve_entry_point(entry_point: Union[Callable, str]) -> Callable:
+    if callable(entry_point):
+        return entry_point
+
+    module_name, function_name = entry_point.split(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def run_init(connection, spec: PipelineSpec) -> None:
+    resolve_entry_point(spec.init)(connection, **(spec.arguments or {}))
+
+
+def run_resume(connection, spec: PipelineSpec) -> None:
+    if spec.resume is not None:
+        resolve_entry_point(spec.resume)(connection, **(spec.arguments or {}))
+
+
+def build_dependency_graph(specs: dict, external_tables=()) -> dict:
+    producers = {}
+    for spec in specs.values():
+        for table in spec.outputs:
+            producers.setdefault(table, []).append(spec.name)
+
+    graph = {}
+    for spec in specs.values():
+        upstream = set()
+        for table in spec.inputs:
+            if table not in producers and table not in external_tables:
+                raise ValueError(f"{spec.name} reads {table}, which no pipeline produces")
+            # A pipeline that updates a table in place lists it as both input and output; that
+            # isn't a dependency on itself.
+            upstream.update(name for name in producers.get(table, []) if name != spec.name)
+        graph[spec.name] = upstream
+
+    topological_order(graph)
+    return graph
+
+
+def topological_order(graph: dict) -> list:
+    remaining = {name: set(upstream) for name, upstream in graph.items()}
+    order = []
+    while remaining:
+        ready = sorted(name for name, upstream in remaining.items() if not upstream)
+        if not ready:
+            raise ValueError(f"Pipeline dependencies form a cycle between {sorted(remaining)}")
+
+        order += ready
+        for name in ready:
+            del remaining[name]
+        for upstream in remaining.values():
+            upstream.difference_update(ready)
+    return order
+
+
+def with_upstream(graph: dict, targets) -> set:
+    selected, pending = set(), list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending += graph[name]
+    return selected
+
+
+def critical_path(graph: dict, durations: dict) -> Tuple[float, list]:
+    finish, previous = {}, {}
+    for name in topological_order(graph):
+        upstream = max(graph[name], key=lambda other: finish[other], default=None)
+        previous[name] = upstream
+        finish[name] = (finish[upstream] if upstream else 0.0) + durations.get(name, 0.0)
+
+    if not finish:
+        return 0.0, []
+
+    name = max(finish, key=finish.get)
+    total, path = finish[name], []
+    while name is not None:
+        path.append(name)
+        name = previous[name]
+    return total, path[::-1]
+
+
+def _existing_tables(connection) -> set:
+    tables = run_query(connection, "SHOW TABLES")
+    return set(tables[tables.columns[-1]].str.lower())
+
+
+def is_up_to_date(connection, spec: PipelineSpec, upstream) -> bool:
+    if not spec.outputs:
+        return False
+
+    metadata = pipeline_metadata(connection)
+    if spec.name not in metadata.index:
+        return False
+
+    last_start = metadata.at[spec.name, "last_pipeline_start"]
+    last_end = metadata.at[spec.name, "last_pipeline_end"]
+    if pd.isnull(last_end) or last_start > last_end:
+        return False
+
+    if not {table.lower() for table in spec.outputs} <= _existing_tables(connection):
+        return False
+
+    upstream_ends = metadata["last_pipeline_end"].reindex(list(upstream))
+    return not (upstream_ends.isnull().any() or (upstream_ends > last_end).any())
+
+
+def run_stage(connection, spec: PipelineSpec, upstream=(), force: bool = False) -> str:
+    create_metadata_table_if_not_exists(connection)
+
+    if not force and is_up_to_date(connection, spec, upstream):
+        print(f"Pipeline {spec.name} is up to date, skipping")
+        return "skipped"
+
+    metadata = pipeline_metadata(connection)
+    resuming = (spec.name in metadata.index and spec.resume is not None and not force
+                and (pd.isnull(metadata.at[spec.name, "last_pipeline_end"])
+                     or metadata.at[spec.name, "last_pipeline_start"]
+                     > metadata.at[spec.name, "last_pipeline_end"]))
+
+    start_time = time.perf_counter()
+    # Stages run on worker threads, where a prompt would block on stdin alongside other stages, so
+    # any table a stage asks to recreate is recreated: it is being rebuilt anyway.
+    with profile_stage(spec.name), answer_prompts(delete_tables=True):
+        if resuming:
+            print(f"Resuming pipeline {spec.name}...")
+        else:
+            print(f"Starting pipeline {spec.name}...")
+            # Outputs this pipeline creates (rather than updates in place) are rebuilt from
+            # scratch, so drop them up front instead of prompting for each one.
+            for table in set(spec.outputs) - set(spec.inputs):
+                run_query(connection, f"DROP TABLE IF EXISTS {table}")
+
+            update_metadata_on_start_pipeline(connection, spec.name)
+            run_init(connection, spec)
+
+        run_resume(connection, spec)
+
+    duration_seconds = time.perf_counter() - start_time
+    update_metadata_on_end_pipeline(connection, spec.name, duration_seconds)
+    print(f"Pipeline {spec.name} finished in {duration_seconds:.1f}s")
+    return "ran"
+
+
+def run_pipelines(pool: ConnectionPool, specs: dict, targets=None, external_tables=(),
+                  force: bool = False
+                  ) -> dict:
+    graph = build_dependency_graph(specs, external_tables)
+    selected = with_upstream(graph, targets if targets is not None else graph.keys())
+    graph = {name: graph[name] & selected for name in selected}
+
+    with pool.connection() as connection:
+        create_metadata_table_if_not_exists(connection)
+        missing = {table.lower() for table in external_tables} - _existing_tables(connection)
+        if missing:
+            raise ValueError(f"External tables {sorted(missing)} must exist before running")
+
+        metadata = pipeline_metadata(connection)
+        durations = metadata["last_duration_seconds"].dropna().to_dict()
+
+    estimate, path = critical_path(graph, durations)
+    print(f"Running {len(graph)} pipelines on {pool.size} connections, "
+          f"critical path {' -> '.join(path)} (~{estimate:.0f}s from previous runs)"
+          )
+
+    def run(name):
+        with pool.connection() as stage_connection:
+            return run_stage(stage_connection, specs[name], graph[name], force)
+
+    statuses = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        while len(statuses) < len(graph):
+            for name in topological_order(graph):
+                if name in statuses or name in running.values():
+                    continue
+                if any(statuses.get(upstream) in ("failed", "blocked") for upstream in graph[name]):
+                    statuses[name] = "blocked"
+                    print(f"Pipeline {name} not run because an upstream pipeline failed")
+                elif all(upstream in statuses for upstream in graph[name]):
+                    running[executor.submit(run, name)] = name
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    statuses[name] = future.result()
+                except Exception as e:
+                    statuses[name] = "failed"
+                    print(f"Pipeline {name} failed: {e}")
+
+    return statuses
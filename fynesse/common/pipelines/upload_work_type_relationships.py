@@ -1,11 +1,11 @@
-import pandas as pd
-
+from fynesse.access import http_cache
+from fynesse.access.fetch import PRACTICALS_URL
 from fynesse.common.db.db_operations import upload_to_database
 
 
 def init_upload_work_type_relationships(connection):
-    url = "https://github.com/FlamingoWinter/ads_practicals/raw/refs/heads/main/hours_worked_by_detailed_work_type.csv"
-    raw_hours_worked_by_detailed_work_type = pd.read_csv(url)
+    url = f"{PRACTICALS_URL}/hours_worked_by_detailed_work_type.csv"
+    raw_hours_worked_by_detailed_work_type = http_cache.read_csv(url)
 
 
     hours_worked_by_detailed_work_type = raw_hours_worked_by_detailed_work_type.pivot_table(
@@ -28,8 +28,8 @@ def init_upload_work_type_relationships(connection):
             'hours_16_to_30'
     ]
 
-    url = "https://github.com/FlamingoWinter/ads_practicals/raw/refs/heads/main/hours_worked_by_work_type.csv"
-    raw_hours_worked_by_work_type = pd.read_csv(url)
+    url = f"{PRACTICALS_URL}/hours_worked_by_work_type.csv"
+    raw_hours_worked_by_work_type = http_cache.read_csv(url)
 
     hours_worked_by_work_type = raw_hours_worked_by_work_type.pivot_table(
             index=["Occupation (current) (10 categories) Code",
@@ -50,8 +50,8 @@ def init_upload_work_type_relationships(connection):
             'hours_16_to_30'
     ]
 
-    url = "https://github.com/FlamingoWinter/ads_practicals/raw/refs/heads/main/distance_travelled_by_work_type.csv"
-    raw_distance_travelled_by_work_type = pd.read_csv(url)
+    url = f"{PRACTICALS_URL}/distance_travelled_by_work_type.csv"
+    raw_distance_travelled_by_work_type = http_cache.read_csv(url)
 
     distance_travelled_by_work_type = raw_distance_travelled_by_work_type.pivot_table(
             index=["Occupation (current) (10 categories) Code",
@@ -75,8 +75,8 @@ def init_upload_work_type_relationships(connection):
             'distance_works_from_home'
     ]
 
-    url = "https://github.com/FlamingoWinter/ads_practicals/raw/refs/heads/main/distance_travelled_by_detailed_work_type.csv"
-    raw_distance_travelled_by_detailed_work_type = pd.read_csv(url)
+    url = f"{PRACTICALS_URL}/distance_travelled_by_detailed_work_type.csv"
+    raw_distance_travelled_by_detailed_work_type = http_cache.read_csv(url)
 
     distance_travelled_by_detailed_work_type = raw_distance_travelled_by_detailed_work_type.pivot_table(
             index=["Occupation (current) (105 categories) Code",
@@ -0,0 +1,177 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from fynesse.access import http_cache
+from fynesse.common.pipelines.price_paid import download_price_paid_data
+
+
+def md5_etag(body):
+    return f'"{hashlib.md5(body).hexdigest()}"'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.received.append((self.path, dict(self.headers)))
+        body, etag = self.server.resources[self.path]
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        requested_range = self.headers.get("Range")
+        if requested_range and self.headers.get("If-Range", etag) == etag:
+            start = int(requested_range[len("bytes="):-1])
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(body)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+            body = body[start:]
+        else:
+            self.send_response(200)
+
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_directory = mock.patch.object(http_cache, "CACHE_DIRECTORY",
+                                                 os.path.join(self.directory, "cache"))
+        self.cache_directory.start()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        # resources maps path -> (body, etag); received records each request's path and headers.
+        self.server.resources, self.server.received = {}, []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.cache_directory.stop()
+        shutil.rmtree(self.directory)
+
+    def serve(self, path, body, etag=None):
+        self.server.resources[path] = (body, etag or md5_etag(body))
+        return f"{self.base_url}{path}"
+
+    def write_partial(self, url, body, etag):
+        path = http_cache.cache_path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.part", "wb") as file:
+            file.write(body)
+        http_cache._write_json(f"{path}.part.json", {"etag": etag, "last_modified": None})
+        return path
+
+    def read(self, path):
+        with open(path, "rb") as file:
+            return file.read()
+
+    def test_download_is_cached(self):
+        body = os.urandom(3 * http_cache.CHUNK_BYTES // 2)
+        url = self.serve("/data.csv", body)
+
+        path = http_cache.cached_download(url)
+        self.assertEqual(self.read(path), body)
+        self.assertEqual(http_cache.cached_download(url), path)
+        self.assertEqual(len(self.server.received), 1)
+
+        http_cache.cached_download(url, max_age=0)
+        self.assertEqual(self.server.received[-1][1]["If-None-Match"], md5_etag(body))
+        self.assertTrue(http_cache.verify(url))
+
+    def test_partial_download_resumes(self):
+        body = os.urandom(100_000)
+        url = self.serve("/data.csv", body)
+        self.write_partial(url, body[:40_000], md5_etag(body))
+
+        path = http_cache.cached_download(url)
+        self.assertEqual(self.server.received[-1][1]["Range"], "bytes=40000-")
+        self.assertEqual(self.read(path), body)
+        self.assertFalse(os.path.exists(f"{path}.part"))
+
+    def test_partial_download_of_changed_resource_restarts(self):
+        body = os.urandom(100_000)
+        url = self.serve("/data.csv", body)
+        self.write_partial(url, os.urandom(40_000), md5_etag(b"old version"))
+
+        self.assertEqual(self.read(http_cache.cached_download(url)), body)
+
+    def test_etag_mismatch_removes_download(self):
+        url = self.serve("/data.csv", b"corrupted in transit", etag=md5_etag(b"original"))
+
+        with self.assertRaises(IOError):
+            http_cache.cached_download(url)
+        path = http_cache.cache_path(url)
+        self.assertFalse(os.path.exists(path) or os.path.exists(f"{path}.part"))
+
+    def test_complete_partial_download_is_finalised_on_416(self):
+        body = os.urandom(50_000)
+        url = self.serve("/data.csv", body)
+        self.write_partial(url, body, md5_etag(body))
+
+        path = http_cache.cached_download(url)
+        self.assertEqual(self.read(path), body)
+        self.assertEqual(len(self.server.received), 1)
+
+    def test_oversized_partial_download_is_restarted_on_416(self):
+        body = os.urandom(50_000)
+        url = self.serve("/data.csv", body)
+        self.write_partial(url, body + b"trailing garbage", md5_etag(body))
+
+        self.assertEqual(self.read(http_cache.cached_download(url)), body)
+        self.assertNotIn("Range", self.server.received[-1][1])
+
+    def test_archive_is_extracted_once_per_version(self):
+        def archive(contents):
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, "w") as zip_file:
+                zip_file.writestr("inner/data.csv", contents)
+            return buffer.getvalue()
+
+        url = self.serve("/data.zip", archive("a,b\n1,2\n"))
+        extract_dir = os.path.join(self.directory, "extracted")
+        extracted_path = os.path.join(extract_dir, "inner", "data.csv")
+
+        http_cache.cached_archive(url, extract_dir)
+        self.assertEqual(self.read(extracted_path), b"a,b\n1,2\n")
+
+        os.remove(extracted_path)
+        http_cache.cached_archive(url, extract_dir)
+        self.assertFalse(os.path.exists(extracted_path))
+
+        self.serve("/data.zip", archive("a,b\n3,4\n"))
+        http_cache.cached_archive(url, extract_dir, max_age=0)
+        self.assertEqual(self.read(extracted_path), b"a,b\n3,4\n")
+
+    def test_price_paid_part_is_downloaded(self):
+        body = b'"{0A1B2C3D-0000-0000-0000-000000000000}",100000,"2000-01-01 00:00","AB1 2CD","D","N","F","1","","ST","","T","D","C","A","A"\n'
+        self.serve("/pp-2000-part1.csv", body)
+
+        path = download_price_paid_data(2000, 1, base_url=self.base_url)
+        self.assertEqual(self.read(path), body)
+        self.assertEqual(download_price_paid_data(2000, 1, base_url=self.base_url), path)
+        self.assertEqual(len(self.server.received), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
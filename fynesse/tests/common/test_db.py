@@ -0,0 +1,45 @@
+import datetime
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from pymysql.constants import FIELD_TYPE, FLAG
+
+from fynesse.common.db.db import _rows_to_columnar_df
+
+
+def cursor_with_fields(*fields):
+    return SimpleNamespace(_result=SimpleNamespace(
+            fields=[SimpleNamespace(name=name, type_code=type_code, flags=flags)
+                    for name, type_code, flags in fields]
+    ))
+
+
+class ColumnarRowsTest(unittest.TestCase):
+    def test_unsigned_bigint_beyond_int64(self):
+        cursor = cursor_with_fields(("db_id", FIELD_TYPE.LONGLONG, FLAG.UNSIGNED))
+
+        df = _rows_to_columnar_df(cursor, [(2 ** 64 - 1,), (1,)])
+        self.assertEqual(df["db_id"].dtype, np.uint64)
+        self.assertEqual(df["db_id"].tolist(), [2 ** 64 - 1, 1])
+
+        df = _rows_to_columnar_df(cursor, [(2 ** 64 - 1,), (None,)])
+        self.assertEqual(str(df["db_id"].dtype), "UInt64")
+        self.assertEqual(df["db_id"].iloc[0], 2 ** 64 - 1)
+
+    def test_zero_dates_are_nat(self):
+        cursor = cursor_with_fields(("date_of_transfer", FIELD_TYPE.DATE, 0),
+                                    ("updated", FIELD_TYPE.DATETIME, 0))
+
+        df = _rows_to_columnar_df(cursor, [(datetime.date(2020, 1, 2), "0000-00-00 00:00:00"),
+                                           ("0000-00-00", datetime.datetime(2021, 3, 4, 5, 6, 7)),
+                                           (None, None)])
+        self.assertEqual(df["date_of_transfer"].tolist()[0], pd.Timestamp("2020-01-02"))
+        self.assertTrue(df["date_of_transfer"].iloc[1:].isna().all())
+        self.assertEqual(df["updated"].tolist()[1], pd.Timestamp("2021-03-04 05:06:07"))
+        self.assertTrue(pd.isna(df["updated"].iloc[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
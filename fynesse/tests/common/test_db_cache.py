@@ -0,0 +1,46 @@
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from fynesse.common.db import db_cache
+
+
+def table_versions(*rows):
+    return pd.DataFrame(rows, columns=["table_name", "CREATE_TIME", "UPDATE_TIME", "unreliable"])
+
+
+class TableVersionsTest(unittest.TestCase):
+    def versions(self, result, use_checksum=False):
+        with mock.patch.object(db_cache, "run_query", return_value=result):
+            return db_cache._table_versions(mock.MagicMock(), sorted(result["table_name"]),
+                                            use_checksum)
+
+    def test_known_update_times_are_versioned(self):
+        versions = self.versions(table_versions(("a", "2024-01-01 00:00:00", "2024-01-02 00:00:00", 0),
+                                                ("b", "2024-01-01 00:00:00", "2024-01-03 00:00:00", 0)))
+        self.assertEqual(versions, [["a", "2024-01-01 00:00:00", "2024-01-02 00:00:00"],
+                                    ["b", "2024-01-01 00:00:00", "2024-01-03 00:00:00"]])
+
+    def test_null_update_time_is_not_cached(self):
+        result = table_versions(("a", "2024-01-01 00:00:00", "2024-01-02 00:00:00", 0),
+                                ("b", "2024-01-01 00:00:00", None, 1))
+        self.assertIsNone(self.versions(result))
+
+    def test_update_in_the_last_second_is_not_cached(self):
+        result = table_versions(("a", "2024-01-01 00:00:00", "2024-01-02 00:00:00", 1))
+        self.assertIsNone(self.versions(result))
+
+    def test_checksum_versions_tables_without_update_time(self):
+        connection = mock.MagicMock()
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [("db.b", 12345)]
+
+        with mock.patch.object(db_cache, "run_query",
+                               return_value=table_versions(("b", "2024-01-01 00:00:00", None, 1))):
+            versions = db_cache._table_versions(connection, ["b"], use_checksum=True)
+        self.assertEqual(versions[-1], ["db.b", "12345"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+import json
+import subprocess
+import sys
+
+RUNS = 5
+
+HEAVY_MODULES = ["osmnx", "seaborn", "matplotlib", "PIL", "geopandas", "shapely", "folium",
+                 "statsmodels", "sklearn", "ipywidgets"]
+
+# (statement, budget in seconds for the best of RUNS cold imports)
+BENCHMARKS = [
+        ("import fynesse", 0.1),
+        ("import fynesse.access", 0.1),
+        ("from fynesse.access.pipelines import resume_pipeline", 1.5),
+]
+
+MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "modules": sorted(sys.modules)}}))
+"""
+
+
+def measure(statement):
+    result = subprocess.run([sys.executable, "-c", MEASURE.format(statement=statement)],
+                            capture_output=True, text=True, check=True
+                            )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+failures = []
+for statement, budget in BENCHMARKS:
+    runs = [measure(statement) for _ in range(RUNS)]
+    seconds = min(run["seconds"] for run in runs)
+    heavy = [module for module in HEAVY_MODULES if module in runs[0]["modules"]]
+
+    print(f"{statement}: {seconds:.3f}s (budget {budget:.1f}s)"
+          + (f", imports {', '.join(heavy)}" if heavy else "")
+          )
+
+    if seconds > budget:
+        failures.append(f"'{statement}' took {seconds:.3f}s, over its {budget:.1f}s budget")
+    if heavy:
+        failures.append(f"'{statement}' eagerly imports {', '.join(heavy)}")
+
+for failure in failures:
+    print(failure)
+
+sys.exit(1 if failures else 0)
@@ -32,6 +32,7 @@ with open("requirements.txt") as f:
 # What packages are optional?
 EXTRAS = {
         "interactive html plots": ["bokeh", ],
+        "local analytics backend": ["duckdb", ],
 }
 
 PACKAGE_DATA = {"fynesse": ["defaults.yml"]}